@@ -0,0 +1,254 @@
+"""
+Controle de admissão e descarte de carga da API
+
+Quando o MySQL fica lento, cada requisição passa a segurar um worker esperando
+o banco, até que nenhum worker sobra (nem para /health). Este módulo limita
+quantas requisições de cada classe ficam ativas ao mesmo tempo:
+
+- leitura: consultas de um único registro ou filtradas por tipo/cidade
+- lote: leituras caras (listagem completa, exportações, análises)
+- alteracoes: long-polling do feed de alterações, que segura a vaga enquanto espera
+- escrita: POST, PUT, PATCH e DELETE
+
+Cada classe tem sua própria fila de espera limitada, então escritas e lotes não
+tomam o lugar das leituras baratas. Quem não consegue vaga até o prazo da
+requisição (ou encontra a fila cheia) recebe 503 com Retry-After, estimado pelo
+tempo médio que as requisições da classe ocupam a vaga. O limite de cada classe
+se ajusta à latência do banco observada nas consultas da própria classe (aumento
+aditivo, redução multiplicativa), então consultas lentas de 'lote' não reduzem o
+limite das leituras baratas.
+"""
+
+import math
+import os
+import threading
+import time
+
+from banco import classe_atual, observadores_latencia
+
+# Rotas caras de leitura, que ficam na classe 'lote'
+ENDPOINTS_LOTE = {'listar_imoveis', 'exportar_imoveis', 'criar_exportacao',
+                  'analisar_valores', 'analisar_histograma', 'analisar_tendencia'}
+
+# O long-polling ocupa a vaga por até 30 s: classe própria, para não esgotar a 'lote'
+ENDPOINTS_ALTERACOES = {'listar_alteracoes'}
+
+# Rotas que não passam pelo controle de admissão
+ENDPOINTS_ISENTOS = {'health_check'}
+
+METODOS_ESCRITA = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# (limite inicial, limite mínimo, limite máximo, tamanho da fila, prazo padrão em segundos)
+CONFIGURACAO_PADRAO = {
+    'leitura': (16, 2, 64, 64, 5.0),
+    'lote': (4, 1, 8, 8, 30.0),
+    'alteracoes': (32, 4, 64, 64, 30.0),
+    'escrita': (8, 1, 32, 32, 10.0),
+}
+
+PESO_MEDIA = 0.2  # peso de cada nova amostra na média móvel da latência
+
+
+def classificar(metodo, endpoint):
+    """Retorna a classe de admissão da requisição, ou None se ela for isenta"""
+    if endpoint is None or endpoint in ENDPOINTS_ISENTOS:
+        return None
+    if endpoint in ENDPOINTS_LOTE:
+        return 'lote'
+    if endpoint in ENDPOINTS_ALTERACOES:
+        return 'alteracoes'
+    if metodo in METODOS_ESCRITA:
+        return 'escrita'
+    return 'leitura'
+
+
+class LatenciaBanco:
+    """Média móvel exponencial de uma duração (latência do banco, tempo de ocupação da vaga)"""
+
+    def __init__(self, peso=PESO_MEDIA):
+        self.peso = peso
+        self.media = None
+        self._lock = threading.Lock()
+
+    def registrar(self, duracao):
+        with self._lock:
+            if self.media is None:
+                self.media = duracao
+            else:
+                self.media += self.peso * (duracao - self.media)
+
+    def valor(self):
+        with self._lock:
+            return self.media
+
+
+class ClasseAdmissao:
+    """Limite de concorrência adaptativo com fila de espera limitada para uma classe de rotas"""
+
+    def __init__(self, nome, limite, limite_minimo, limite_maximo, fila_maxima, prazo_padrao):
+        self.nome = nome
+        self.limite = float(limite)
+        self.limite_minimo = limite_minimo
+        self.limite_maximo = limite_maximo
+        self.fila_maxima = fila_maxima
+        self.prazo_padrao = prazo_padrao
+        self.ativos = 0
+        self.aguardando = 0
+        self.admitidas = 0
+        self.rejeitadas = 0
+        self.expiradas = 0
+        self.latencia = LatenciaBanco()  # Latência das consultas feitas pela classe
+        self.ocupacao = LatenciaBanco()  # Tempo médio entre admissão e liberação
+        self._condicao = threading.Condition()
+
+    def _vagas(self):
+        return int(self.limite) - self.ativos
+
+    def admitir(self, prazo):
+        """
+        Tenta ocupar uma vaga até o prazo (time.monotonic).
+
+        Retorna True se admitida, False se a fila estiver cheia ou o prazo esgotar.
+        """
+        with self._condicao:
+            if self.aguardando == 0 and self._vagas() > 0:
+                self.ativos += 1
+                self.admitidas += 1
+                return True
+
+            if self.aguardando >= self.fila_maxima:
+                self.rejeitadas += 1
+                return False
+
+            self.aguardando += 1
+            try:
+                while self._vagas() <= 0:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        self.expiradas += 1
+                        return False
+                    self._condicao.wait(restante)
+                self.ativos += 1
+                self.admitidas += 1
+                return True
+            finally:
+                self.aguardando -= 1
+
+    def liberar(self, latencia_alvo, ocupacao):
+        """Libera a vaga ocupada por `ocupacao` segundos e ajusta o limite conforme a latência média da classe"""
+        self.ocupacao.registrar(ocupacao)
+        latencia_media = self.latencia.valor()
+        with self._condicao:
+            self.ativos -= 1
+            anterior = int(self.limite)
+            if latencia_media is not None and latencia_media > latencia_alvo:
+                self.limite = max(self.limite_minimo, self.limite * 0.9)
+            else:
+                self.limite = min(self.limite_maximo, self.limite + 1 / self.limite)
+            self._condicao.notify(max(1, int(self.limite) - anterior))
+
+    def retry_after(self):
+        """
+        Estimativa em segundos para o Retry-After de uma requisição rejeitada.
+        
+        Usa o tempo médio de ocupação da vaga (que inclui esperas como o
+        long-polling), ou a latência do banco enquanto não houver liberações.
+        """
+        duracao = self.ocupacao.valor() or self.latencia.valor() or 1.0
+        with self._condicao:
+            espera = duracao * (self.aguardando + 1) / max(1, int(self.limite))
+        return max(1, math.ceil(espera))
+
+    def estatisticas(self):
+        latencia = self.latencia.valor()
+        ocupacao = self.ocupacao.valor()
+        with self._condicao:
+            return {
+                'limite': int(self.limite),
+                'ativos': self.ativos,
+                'aguardando': self.aguardando,
+                'fila_maxima': self.fila_maxima,
+                'admitidas': self.admitidas,
+                'rejeitadas': self.rejeitadas,
+                'expiradas': self.expiradas,
+                'latencia_banco_ms': round(latencia * 1000, 1) if latencia is not None else None,
+                'ocupacao_media_ms': round(ocupacao * 1000, 1) if ocupacao is not None else None,
+            }
+
+
+class Ticket:
+    """Vaga ocupada por uma requisição; liberar() pode ser chamado mais de uma vez"""
+
+    def __init__(self, controle, classe):
+        self.controle = controle
+        self.classe = classe
+        self.agendado = False
+        self.inicio = time.monotonic()
+        self._liberado = False
+        self._lock = threading.Lock()
+
+    def liberar(self):
+        with self._lock:
+            if self._liberado:
+                return
+            self._liberado = True
+        self.controle._liberar(self.classe, time.monotonic() - self.inicio)
+
+
+class ControleAdmissao:
+    """Controle de admissão com uma ClasseAdmissao por classe de rota"""
+
+    def __init__(self, configuracao=None, latencia_alvo=0.25):
+        self.latencia_alvo = latencia_alvo
+        self.latencia = LatenciaBanco()  # Todas as consultas, só para /debug
+        self.classes = {
+            nome: ClasseAdmissao(nome, *valores)
+            for nome, valores in (configuracao or CONFIGURACAO_PADRAO).items()
+        }
+
+    @classmethod
+    def do_ambiente(cls):
+        """Cria o controle lendo limites de variáveis de ambiente (ADMISSAO_LEITURA_LIMITE, ...)"""
+        configuracao = {}
+        for nome, (limite, minimo, maximo, fila, prazo) in CONFIGURACAO_PADRAO.items():
+            prefixo = f'ADMISSAO_{nome.upper()}_'
+            configuracao[nome] = (
+                int(os.getenv(prefixo + 'LIMITE', limite)),
+                int(os.getenv(prefixo + 'LIMITE_MINIMO', minimo)),
+                int(os.getenv(prefixo + 'LIMITE_MAXIMO', maximo)),
+                int(os.getenv(prefixo + 'FILA', fila)),
+                float(os.getenv(prefixo + 'PRAZO', prazo)),
+            )
+        controle = cls(configuracao, float(os.getenv('ADMISSAO_LATENCIA_ALVO', 0.25)))
+        observadores_latencia.append(controle.registrar_latencia)
+        return controle
+
+    def prazo_padrao(self, classe):
+        return self.classes[classe].prazo_padrao
+
+    def admitir(self, classe, prazo):
+        """Retorna um Ticket se a requisição foi admitida até o prazo, ou None"""
+        if self.classes[classe].admitir(prazo):
+            return Ticket(self, classe)
+        return None
+
+    def registrar_latencia(self, duracao):
+        """Registra a duração de uma consulta na classe da requisição (ou thread) que a fez"""
+        self.latencia.registrar(duracao)
+        classe = self.classes.get(classe_atual.get())
+        if classe is not None:
+            classe.latencia.registrar(duracao)
+
+    def _liberar(self, classe, ocupacao):
+        self.classes[classe].liberar(self.latencia_alvo, ocupacao)
+
+    def retry_after(self, classe):
+        return self.classes[classe].retry_after()
+
+    def estatisticas(self):
+        media = self.latencia.valor()
+        return {
+            'latencia_banco_ms': round(media * 1000, 1) if media is not None else None,
+            'latencia_alvo_ms': round(self.latencia_alvo * 1000, 1),
+            'classes': {nome: classe.estatisticas() for nome, classe in self.classes.items()},
+        }
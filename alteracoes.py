@@ -0,0 +1,171 @@
+"""
+Feed incremental de alterações da tabela imoveis
+
+Permite que sistemas externos sincronizem o inventário buscando apenas o que
+mudou desde a última leitura, em vez de baixar GET /imoveis inteiro.
+
+- Criações e atualizações vêm da coluna updated_at da tabela imoveis
+- Remoções vêm da tabela imoveis_removidos (gravada por deletar_imovel)
+- O token é opaco e codifica a posição (momento, id) da última alteração lida
+- No long-polling, quem aguarda é acordado pelas escritas deste worker
+  (notificar_escrita) e só consulta o banco periodicamente
+  (ALTERACOES_VERIFICAR segundos) para ver escritas de outros workers
+"""
+
+import base64
+import binascii
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from banco import execute_query
+
+TAMANHO_PAGINA_PADRAO = 100
+TAMANHO_PAGINA_MAXIMO = 1000
+ESPERA_MAXIMA = 30  # segundos de long-polling
+INTERVALO_VERIFICACAO = float(os.getenv('ALTERACOES_VERIFICAR', 5))  # segundos entre consultas sem escritas locais
+
+# updated_at tem resolução de segundos: alterações do segundo corrente (e do
+# anterior, cujo commit pode ainda não estar visível) só são entregues depois,
+# para que nenhuma linha fique para trás de um token já emitido
+MARGEM_ESTABILIZACAO = timedelta(seconds=2)
+
+# Espera após uma escrita até ela entrar no feed (a margem, mais o segundo
+# incompleto de updated_at e de CURRENT_TIMESTAMP)
+ATRASO_VISIBILIDADE = MARGEM_ESTABILIZACAO.total_seconds() + 1
+
+INICIO = (datetime(1970, 1, 1), 0)
+
+_escritas = threading.Condition()
+_ultima_escrita = None  # time.monotonic() da última escrita feita por este worker
+
+
+class TokenInvalido(ValueError):
+    """Token de alterações malformado"""
+
+
+def codificar_token(momento, id):
+    """Gera o token opaco para a posição (momento, id)"""
+    bruto = f"{momento:%Y-%m-%d %H:%M:%S}|{int(id)}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip('=')
+
+
+def decodificar_token(token):
+    """Converte o token recebido de volta na posição (momento, id)"""
+    if not token:
+        return INICIO
+
+    try:
+        preenchido = token + '=' * (-len(token) % 4)
+        bruto = base64.urlsafe_b64decode(preenchido.encode()).decode()
+        momento, id = bruto.split('|')
+        return datetime.strptime(momento, '%Y-%m-%d %H:%M:%S'), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise TokenInvalido(token)
+
+
+def _apos_posicao(coluna, momento, id, limite_superior, limite):
+    """Parâmetros e filtro comuns às duas fontes de alterações"""
+    filtro = f'''
+        WHERE ({coluna} > %s OR ({coluna} = %s AND id > %s)) AND {coluna} < %s
+        ORDER BY {coluna}, id LIMIT %s
+    '''
+    return filtro, (momento, momento, id, limite_superior, limite)
+
+
+def ler_pagina(token=None, limite=TAMANHO_PAGINA_PADRAO):
+    """
+    Lê uma página de alterações posteriores ao token.
+
+    Retorna um dicionário com as alterações, o próximo token e se há mais
+    páginas disponíveis, ou None em caso de erro no banco.
+    """
+    momento, id = decodificar_token(token)
+
+    agora = execute_query('SELECT CURRENT_TIMESTAMP AS agora')
+    if not agora:
+        return None
+    agora = agora[0]['agora']
+    if isinstance(agora, str):  # O SQLite devolve CURRENT_TIMESTAMP como texto
+        agora = datetime.fromisoformat(agora)
+    limite_superior = agora - MARGEM_ESTABILIZACAO
+
+    filtro, params = _apos_posicao('updated_at', momento, id, limite_superior, limite + 1)
+    alterados = execute_query(f'SELECT * FROM imoveis {filtro}', params)
+
+    filtro, params = _apos_posicao('deleted_at', momento, id, limite_superior, limite + 1)
+    removidos = execute_query(f'SELECT id, deleted_at FROM imoveis_removidos {filtro}', params)
+
+    if alterados is None or removidos is None:
+        return None
+
+    alteracoes = [
+        (imovel['updated_at'], int(imovel['id']), {
+            'operacao': 'alteracao',
+            'id': int(imovel['id']),
+            'em': imovel['updated_at'],
+            'imovel': imovel
+        })
+        for imovel in alterados
+    ] + [
+        (removido['deleted_at'], int(removido['id']), {
+            'operacao': 'remocao',
+            'id': int(removido['id']),
+            'em': removido['deleted_at']
+        })
+        for removido in removidos
+    ]
+    alteracoes.sort(key=lambda alteracao: alteracao[:2])
+
+    pagina = alteracoes[:limite]
+    if pagina:
+        proximo = codificar_token(*pagina[-1][:2])
+    else:
+        proximo = codificar_token(momento, id)
+
+    return {
+        'alteracoes': [alteracao[2] for alteracao in pagina],
+        'proximo': proximo,
+        'mais': len(alteracoes) > limite
+    }
+
+
+def aguardar_pagina(token=None, limite=TAMANHO_PAGINA_PADRAO, espera=0):
+    """
+    Igual a ler_pagina, mas aguarda até `espera` segundos por novas alterações
+    quando não há nenhuma disponível (long-polling).
+    """
+    prazo = time.monotonic() + min(espera, ESPERA_MAXIMA)
+
+    while True:
+        lido_em = time.monotonic()
+        pagina = ler_pagina(token, limite)
+        if pagina is None or pagina['alteracoes'] or time.monotonic() >= prazo:
+            return pagina
+        _aguardar_escrita(lido_em, prazo)
+
+
+def notificar_escrita():
+    """Registra uma escrita deste worker, acordando quem aguarda no long-polling"""
+    global _ultima_escrita
+    with _escritas:
+        _ultima_escrita = time.monotonic()
+        _escritas.notify_all()
+
+
+def _aguardar_escrita(lido_em, prazo):
+    """
+    Espera até valer a pena consultar o feed de novo: quando uma escrita local
+    posterior à leitura feita em lido_em ficar visível, ou após
+    INTERVALO_VERIFICACAO segundos, o que vier primeiro (sem passar do prazo).
+    """
+    with _escritas:
+        while True:
+            proxima = min(prazo, lido_em + INTERVALO_VERIFICACAO)
+            if _ultima_escrita is not None and _ultima_escrita + ATRASO_VISIBILIDADE > lido_em:
+                proxima = min(proxima, _ultima_escrita + ATRASO_VISIBILIDADE)
+            restante = proxima - time.monotonic()
+            if restante <= 0:
+                return
+            _escritas.wait(restante)
@@ -0,0 +1,207 @@
+"""
+Análises de valor dos imóveis: percentis, histogramas e tendência por ano
+
+As colunas usadas (cidade, tipo, valor, data_aquisicao) são carregadas do banco
+de uma só vez em arrays NumPy e reaproveitadas até a próxima atualização dos
+dados. Os cálculos por grupo (cidade, tipo ou ano de aquisição) são vetorizados:
+os valores são ordenados uma vez por (grupo, valor) e os percentis de todos os
+grupos saem de uma única interpolação.
+
+Os resultados ficam em cache por filtro, limitado aos ANALISE_CACHE_TAMANHO
+mais recentes (LRU), já que os filtros vêm da URL. O cache é descartado quando a
+API grava algum imóvel (invalidar) ou após ANALISE_TTL segundos, para refletir
+gravações feitas por outros workers.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from banco import execute_query
+
+AGRUPAMENTOS = ['cidade', 'tipo', 'ano']
+FILTROS = ['cidade', 'tipo', 'ano']
+PERCENTIS = {'p10': 0.10, 'mediana': 0.50, 'p90': 0.90}
+FAIXAS_PADRAO = 10
+FAIXAS_MAXIMO = 100
+TTL = float(os.getenv('ANALISE_TTL', 60))
+TAMANHO_CACHE = int(os.getenv('ANALISE_CACHE_TAMANHO', 128))
+
+
+class ErroAnalise(Exception):
+    """Falha ao carregar os dados do banco"""
+
+
+def _ano(data):
+    """Ano de aquisição de um date ou de um texto 'AAAA-MM-DD' (-1 se ausente)"""
+    if data is None:
+        return -1
+    if hasattr(data, 'year'):
+        return data.year
+    try:
+        return int(str(data)[:4])
+    except ValueError:
+        return -1
+
+
+class Analise:
+    """Dados em memória e cache de resultados das análises de valor"""
+
+    def __init__(self, ttl=TTL, tamanho_cache=TAMANHO_CACHE):
+        self.ttl = ttl
+        self.tamanho_cache = tamanho_cache
+        self._lock = threading.Lock()
+        self._dados = None
+        self._carregado_em = 0.0
+        self._cache = OrderedDict()  # chave -> resultado, do menos ao mais recente
+
+    def invalidar(self):
+        """Descarta dados e resultados; a próxima análise recarrega do banco"""
+        with self._lock:
+            self._dados = None
+            self._cache = OrderedDict()
+
+    def _obter_dados(self):
+        # Chamado com self._lock adquirido
+        if self._dados is not None and time.monotonic() - self._carregado_em < self.ttl:
+            return self._dados
+
+        linhas = execute_query('''
+            SELECT cidade, tipo, valor, data_aquisicao FROM imoveis WHERE valor IS NOT NULL
+        ''')
+        if linhas is None:
+            raise ErroAnalise('Erro ao carregar imóveis')
+
+        self._dados = {
+            'valor': np.array([linha['valor'] for linha in linhas], dtype=np.float64),
+            'cidade': np.array([linha['cidade'] or '' for linha in linhas], dtype=object),
+            'tipo': np.array([linha['tipo'] or '' for linha in linhas], dtype=object),
+            'ano': np.array([_ano(linha['data_aquisicao']) for linha in linhas], dtype=np.int64),
+        }
+        self._carregado_em = time.monotonic()
+        self._cache = OrderedDict()
+        return self._dados
+
+    def _em_cache(self, chave, calcular):
+        with self._lock:
+            dados = self._obter_dados()
+            if chave in self._cache:
+                self._cache.move_to_end(chave)
+                return self._cache[chave]
+            resultado = self._cache[chave] = calcular(dados)
+            if len(self._cache) > self.tamanho_cache:
+                self._cache.popitem(last=False)
+            return resultado
+
+    def valores(self, por, filtros):
+        """Quantidade, média, mínimo, p10, mediana, p90 e máximo de valor por grupo"""
+        chave = ('valores', por, _chave_filtros(filtros))
+        return self._em_cache(chave, lambda dados: _estatisticas_por_grupo(*_agrupar(dados, por, filtros)))
+
+    def histograma(self, por, filtros, faixas=FAIXAS_PADRAO):
+        """Contagens por faixa de valor, com as mesmas faixas para todos os grupos"""
+        chave = ('histograma', por, _chave_filtros(filtros), faixas)
+        return self._em_cache(chave, lambda dados: _histograma_por_grupo(*_agrupar(dados, por, filtros), faixas))
+
+    def tendencia(self, filtros):
+        """Mediana de valor por ano de aquisição e sua variação em relação ao ano anterior com dados"""
+        chave = ('tendencia', _chave_filtros(filtros))
+        return self._em_cache(chave, lambda dados: _tendencia_anual(dados, filtros))
+
+
+def _chave_filtros(filtros):
+    return tuple((campo, filtros.get(campo)) for campo in FILTROS)
+
+
+def _filtrar(dados, filtros):
+    mascara = np.ones(len(dados['valor']), dtype=bool)
+    for campo in FILTROS:
+        if filtros.get(campo) is not None:
+            mascara &= dados[campo] == filtros[campo]
+    return mascara
+
+
+def _agrupar(dados, por, filtros):
+    """Valores filtrados ordenados por (grupo, valor), com os nomes e limites de cada grupo"""
+    mascara = _filtrar(dados, filtros)
+    valores = dados['valor'][mascara]
+    grupos, codigos = np.unique(dados[por][mascara], return_inverse=True)
+    ordem = np.lexsort((valores, codigos))
+    quantidades = np.bincount(codigos, minlength=len(grupos))
+    inicios = np.concatenate(([0], np.cumsum(quantidades)[:-1])).astype(np.int64)
+    return valores[ordem], codigos[ordem], grupos, inicios, quantidades
+
+
+def _percentis_ordenados(valores, inicios, quantidades, q):
+    """Percentil q (interpolação linear) de cada grupo de um array ordenado por grupo"""
+    posicao = inicios + q * (quantidades - 1)
+    abaixo = np.floor(posicao).astype(np.int64)
+    acima = np.ceil(posicao).astype(np.int64)
+    peso = posicao - abaixo
+    return valores[abaixo] * (1 - peso) + valores[acima] * peso
+
+
+def _nome_grupo(grupo):
+    if isinstance(grupo, np.integer):
+        return int(grupo) if grupo >= 0 else None  # ano -1: sem data de aquisição
+    return grupo
+
+
+def _estatisticas_por_grupo(valores, codigos, grupos, inicios, quantidades):
+    if len(grupos) == 0:
+        return []
+
+    medias = np.bincount(codigos, weights=valores, minlength=len(grupos)) / quantidades
+    colunas = {
+        'quantidade': quantidades,
+        'media': medias,
+        'min': valores[inicios],
+        **{nome: _percentis_ordenados(valores, inicios, quantidades, q) for nome, q in PERCENTIS.items()},
+        'max': valores[inicios + quantidades - 1],
+    }
+    return [
+        {'grupo': _nome_grupo(grupo),
+         **{nome: (int(coluna[i]) if nome == 'quantidade' else round(float(coluna[i]), 2))
+            for nome, coluna in colunas.items()}}
+        for i, grupo in enumerate(grupos)
+    ]
+
+
+def _histograma_por_grupo(valores, codigos, grupos, inicios, quantidades, faixas):
+    if len(grupos) == 0:
+        return {'limites': [], 'grupos': []}
+
+    limites = np.histogram_bin_edges(valores, bins=faixas)
+    # A última faixa inclui o valor máximo, como em np.histogram
+    faixa = np.clip(np.searchsorted(limites, valores, side='right') - 1, 0, faixas - 1)
+    contagens = np.bincount(codigos * faixas + faixa, minlength=len(grupos) * faixas).reshape(len(grupos), faixas)
+    return {
+        'limites': [round(float(limite), 2) for limite in limites],
+        'grupos': [
+            {'grupo': _nome_grupo(grupo), 'contagens': contagens[i].tolist()}
+            for i, grupo in enumerate(grupos)
+        ]
+    }
+
+
+def _tendencia_anual(dados, filtros):
+    valores, codigos, anos, inicios, quantidades = _agrupar(dados, 'ano', filtros)
+    if len(anos) == 0:
+        return []
+
+    conhecidos = anos >= 0  # imóveis sem data de aquisição ficam de fora
+    medianas = _percentis_ordenados(valores, inicios, quantidades, 0.5)[conhecidos]
+    anos, quantidades = anos[conhecidos], quantidades[conhecidos]
+    variacoes = np.full(len(anos), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variacoes[1:] = medianas[1:] / medianas[:-1] - 1
+    return [
+        {'ano': int(ano),
+         'quantidade': int(quantidade),
+         'mediana': round(float(mediana), 2),
+         'variacao_mediana': round(float(variacao), 4) if np.isfinite(variacao) else None}
+        for ano, quantidade, mediana, variacao in zip(anos, quantidades, medianas, variacoes)
+    ]
@@ -1,7 +1,21 @@
-from flask import Flask, request, jsonify
-from database_mysql import init_db, execute_query, test_connection
+from flask import Flask, request, jsonify, Response, send_file, g
+from banco import (Error, NOME_BANCO, init_db, execute_query, execute_update, execute_transaction,
+                   test_connection, prazo_atual, classe_atual, tempo_restante, estatisticas_banco,
+                   estrutura_banco)
 from models import Imovel
+import admissao
+import alteracoes
+import analise
+import atexit
+import coalescencia
+import contagem
+import exportar
+import gravacao_em_grupo
+import math
 import os
+import re
+import time
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 
 # Carregar variáveis de ambiente
@@ -21,6 +35,232 @@ if not os.getenv('TESTING') and not app.config.get('TESTING'):
         print("❌ Erro: Não foi possível inicializar o banco de dados!")
         exit(1)
 
+# Controle de admissão: limita requisições simultâneas por classe de rota (desativar com ADMISSAO_ATIVA=0)
+controle_admissao = admissao.ControleAdmissao.do_ambiente() if os.getenv('ADMISSAO_ATIVA', '1') != '0' else None
+
+@app.before_request
+def admitir_requisicao():
+    """Reserva uma vaga para a requisição ou a rejeita com 503 em caso de sobrecarga"""
+    if controle_admissao is None:
+        return None
+    
+    classe = admissao.classificar(request.method, request.endpoint)
+    if classe is None:
+        return None
+    g.classe_token = classe_atual.set(classe)
+    
+    # O cliente pode encurtar (não estender) o prazo com o cabeçalho X-Request-Timeout (segundos)
+    prazo = controle_admissao.prazo_padrao(classe)
+    try:
+        prazo = min(prazo, float(request.headers.get('X-Request-Timeout', prazo)))
+    except ValueError:
+        pass
+    prazo = time.monotonic() + prazo
+    g.prazo_token = prazo_atual.set(prazo)
+    
+    ticket = controle_admissao.admitir(classe, prazo)
+    if ticket is None:
+        resposta = jsonify({'erro': 'Servidor sobrecarregado, tente novamente mais tarde'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = str(controle_admissao.retry_after(classe))
+        return resposta
+    
+    g.admissao = ticket
+    return None
+
+@app.after_request
+def agendar_liberacao(response):
+    """Em respostas por streaming, libera a vaga só quando o envio terminar"""
+    ticket = g.get('admissao')
+    if ticket is not None and response.is_streamed:
+        response.call_on_close(ticket.liberar)
+        ticket.agendado = True
+    return response
+
+@app.teardown_request
+def encerrar_admissao(error=None):
+    """Libera a vaga (exceto em streaming) e descarta o prazo e a classe da requisição"""
+    ticket = g.pop('admissao', None)
+    if ticket is not None and not ticket.agendado:
+        ticket.liberar()
+    
+    token = g.pop('prazo_token', None)
+    if token is not None:
+        prazo_atual.reset(token)
+    token = g.pop('classe_token', None)
+    if token is not None:
+        classe_atual.reset(token)
+
+# Leituras idênticas simultâneas compartilham a mesma consulta ao banco
+coalescedor = coalescencia.SingleFlight()
+ESPERA_COALESCENCIA_PADRAO = 10  # segundos, quando a requisição não tem prazo
+
+def _resposta_coalescida(query, params, montar):
+    """
+    Executa a consulta (ou aguarda a idêntica em andamento) e devolve a resposta JSON.
+    
+    montar recebe o resultado de execute_query e retorna (dados, status, cabeçalhos). A
+    serialização acontece uma única vez e é compartilhada entre as requisições.
+    """
+    def executar():
+        dados, status, cabecalhos = montar(execute_query(query, params))
+        return app.json.dumps(dados).encode('utf-8') + b'\n', status, cabecalhos
+    
+    espera = tempo_restante()
+    try:
+        # Uma falha do líder (talvez pelo prazo mais curto dele) não é herdada por quem ainda tem tempo
+        (corpo, status, cabecalhos), coalescida = coalescedor.executar(
+            coalescencia.normalizar_chave(query, params), executar,
+            espera if espera is not None else ESPERA_COALESCENCIA_PADRAO,
+            falhou=lambda resultado: resultado[1] >= 500)
+    except coalescencia.TempoEsgotado:
+        resposta = jsonify({'erro': 'Tempo esgotado aguardando a consulta'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '1'
+        return resposta
+    
+    resposta = Response(corpo, status, headers=cabecalhos, mimetype='application/json')
+    if coalescida:
+        resposta.headers['X-Coalesced'] = 'true'
+    return resposta
+
+# Análises de valor com dados e resultados em cache até a próxima escrita
+analises = analise.Analise()
+
+def _registrar_escrita():
+    """Invalida o que depende dos dados após uma escrita bem-sucedida"""
+    coalescedor.invalidar()
+    analises.invalidar()
+    alteracoes.notificar_escrita()
+
+# Totais de imóveis mantidos em memória para o cabeçalho X-Total-Count e /debug
+contadores = contagem.Contadores().iniciar()
+
+def _atualizar_imovel(id, query, valores, campos):
+    """
+    Executa o UPDATE de um imóvel e mantém os contadores em dia.
+    
+    Se tipo ou cidade mudam, os valores anteriores são lidos (com a linha
+    bloqueada) na mesma transação do UPDATE, para mover o imóvel entre os
+    totais. Retorna (linhas afetadas, LAST_INSERT_ID) como execute_update, ou
+    None em caso de erro.
+    """
+    if 'tipo' not in campos and 'cidade' not in campos:
+        resultado = execute_update(query, valores)
+        if resultado is not None and resultado[0]:
+            _registrar_escrita()
+        return resultado
+    
+    resultados = execute_transaction([
+        ('SELECT tipo, cidade FROM imoveis WHERE id = %s FOR UPDATE', (id,)),
+        (query, valores)
+    ])
+    if resultados is None:
+        return None
+    anterior, atualizado = resultados
+    # execute_transaction devolve o LAST_INSERT_ID quando há um, senão as linhas afetadas
+    if not anterior or not atualizado:
+        return 0, 0
+    anterior = anterior[0]['tipo'], anterior[0]['cidade']
+    contadores.registrar_atualizacao(anterior, (campos.get('tipo', anterior[0]), campos.get('cidade', anterior[1])))
+    _registrar_escrita()
+    return 1, atualizado
+
+def _lista_ou_erro(imoveis):
+    if imoveis is None:
+        return {'erro': 'Erro interno do servidor'}, 500, {}
+    # Sem paginação o total é o próprio tamanho da lista
+    return imoveis, 200, {'X-Total-Count': str(len(imoveis)), 'X-Total-Count-Exact': 'true'}
+
+def _paginacao():
+    """Lê os parâmetros opcionais limit e offset, retornando (limite, deslocamento) ou None se inválidos"""
+    try:
+        limite = int(request.args['limit']) if 'limit' in request.args else None
+        deslocamento = int(request.args.get('offset', 0))
+    except ValueError:
+        return None
+    if (limite is not None and limite < 1) or deslocamento < 0:
+        return None
+    return limite, deslocamento
+
+def _consulta_paginada(query, params, limite, deslocamento):
+    if limite is None:
+        return query, params
+    return f'{query} LIMIT %s OFFSET %s', params + (limite, deslocamento)
+
+def _definir_total(resposta, tipo=None, cidade=None):
+    """
+    Em listagens paginadas, informa em X-Total-Count o total de imóveis do filtro.
+    
+    Por padrão usa os contadores em memória (estimado); com ?contagem=exata
+    executa um COUNT(*) no banco.
+    """
+    if resposta.status_code != 200:
+        return resposta
+    
+    exata = request.args.get('contagem') == 'exata'
+    total = contagem.contar_exato(tipo, cidade) if exata else contadores.contar(tipo, cidade)
+    if total is None:
+        resposta.headers.pop('X-Total-Count', None)
+        resposta.headers.pop('X-Total-Count-Exact', None)
+    else:
+        resposta.headers['X-Total-Count'] = str(total)
+        resposta.headers['X-Total-Count-Exact'] = 'true' if exata else 'false'
+    return resposta
+
+def _registro_ou_erro(imoveis):
+    if imoveis is None:
+        return {'erro': 'Erro interno do servidor'}, 500, {}
+    if not imoveis:
+        return {'erro': 'Imóvel não encontrado'}, 404, {}
+    return imoveis[0], 200, {'ETag': _etag(imoveis[0]['versao'])}
+
+QUERY_INSERIR_IMOVEL = '''
+    INSERT INTO imoveis (logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+'''
+
+# Gravação em grupo das inserções de POST /imoveis (ativar com GRAVACAO_EM_GRUPO=1)
+fila_gravacao = None
+if os.getenv('GRAVACAO_EM_GRUPO') == '1':
+    fila_gravacao = gravacao_em_grupo.FilaGravacao(
+        QUERY_INSERIR_IMOVEL,
+        max_linhas=int(os.getenv('GRUPO_MAX_LINHAS', 50)),
+        max_espera_ms=float(os.getenv('GRUPO_MAX_ESPERA_MS', 5)),
+        capacidade=int(os.getenv('GRUPO_CAPACIDADE', 1000))
+    ).iniciar()
+    atexit.register(fila_gravacao.encerrar)
+
+ESPERA_GRAVACAO_PADRAO = 10  # segundos, quando a requisição não tem prazo
+
+def _inserir_imovel(params):
+    """
+    Insere o imóvel pela fila de gravação em grupo, ou diretamente se ela estiver desativada ou cheia.
+    
+    Levanta TimeoutError se o prazo esgotar antes de o lote começar a ser
+    gravado; nesse caso a linha sai da fila e não é gravada.
+    """
+    futuro = fila_gravacao.enfileirar(params) if fila_gravacao is not None else None
+    if futuro is None:
+        return execute_query(QUERY_INSERIR_IMOVEL, params)
+    
+    restante = tempo_restante()
+    try:
+        return futuro.result(timeout=max(0, restante) if restante is not None else ESPERA_GRAVACAO_PADRAO)
+    except TimeoutError:
+        if futuro.cancel():
+            raise
+    except Exception as e:
+        print(f"Erro ao criar imóvel: {e}")
+        return None
+    
+    # O lote já está sendo gravado: aguardar o resultado para não gravar sem responder
+    try:
+        return futuro.result(timeout=ESPERA_GRAVACAO_PADRAO)
+    except Exception as e:
+        print(f"Erro ao criar imóvel: {e}")
+        return None
+
 def get_test_db_flag():
     """Verifica se deve usar banco de teste"""
     return app.config.get('TESTING', False)
@@ -28,25 +268,24 @@ def get_test_db_flag():
 @app.route('/imoveis', methods=['GET'])
 def listar_imoveis():
     """Lista todos os imóveis"""
-    imoveis = execute_query('SELECT * FROM imoveis ORDER BY id')
+    paginacao = _paginacao()
+    if paginacao is None:
+        return jsonify({'erro': 'Parâmetros limit e offset devem ser inteiros positivos'}), 400
+    
+    imoveis = execute_query(*_consulta_paginada('SELECT * FROM imoveis ORDER BY id', (), *paginacao))
     
     if imoveis is None:
         return jsonify({'erro': 'Erro interno do servidor'}), 500
     
-    return jsonify(imoveis)
+    dados, status, cabecalhos = _lista_ou_erro(imoveis)
+    resposta = jsonify(dados)
+    resposta.headers.update(cabecalhos)
+    return _definir_total(resposta) if paginacao[0] is not None else resposta
 
 @app.route('/imoveis/<int:id>', methods=['GET'])
 def obter_imovel(id):
     """Obtém um imóvel específico pelo ID"""
-    imoveis = execute_query('SELECT * FROM imoveis WHERE id = %s', (id,))
-    
-    if imoveis is None:
-        return jsonify({'erro': 'Erro interno do servidor'}), 500
-    
-    if not imoveis:
-        return jsonify({'erro': 'Imóvel não encontrado'}), 404
-    
-    return jsonify(imoveis[0])
+    return _resposta_coalescida('SELECT * FROM imoveis WHERE id = %s', (id,), _registro_ou_erro)
 
 @app.route('/imoveis', methods=['POST'])
 def criar_imovel():
@@ -60,11 +299,6 @@ def criar_imovel():
             return jsonify({'erro': f'Campo {campo} é obrigatório'}), 400
     
     try:
-        query = '''
-            INSERT INTO imoveis (logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        '''
-        
         params = (
             data['logradouro'],
             data.get('tipo_logradouro'),
@@ -76,17 +310,139 @@ def criar_imovel():
             data.get('data_aquisicao')
         )
         
-        imovel_id = execute_query(query, params)
+        try:
+            imovel_id = _inserir_imovel(params)
+        except TimeoutError:
+            resposta = jsonify({'erro': 'Tempo esgotado aguardando a gravação'})
+            resposta.status_code = 503
+            resposta.headers['Retry-After'] = '1'
+            return resposta
         
         if imovel_id is None:
             return jsonify({'erro': 'Erro ao criar imóvel'}), 500
         
+        contadores.registrar_criacao(data.get('tipo'), data['cidade'])
+        _registrar_escrita()
         return jsonify({'id': imovel_id, 'mensagem': 'Imóvel criado com sucesso'}), 201
         
     except Exception as e:
         print(f"Erro ao criar imóvel: {e}")
         return jsonify({'erro': 'Erro ao criar imóvel'}), 500
 
+CAMPOS_ATUALIZAVEIS = ['logradouro', 'tipo_logradouro', 'bairro', 'cidade', 'cep', 'tipo', 'valor', 'data_aquisicao']
+
+# Todos os campos aparecem em todo UPDATE, cada um com um indicador de "informado":
+# o texto da query não depende dos campos enviados e o prepared statement é reaproveitado
+ATRIBUICOES_IMOVEL = ', '.join(f'{campo} = CASE WHEN %s THEN %s ELSE {campo} END' for campo in CAMPOS_ATUALIZAVEIS)
+
+MAXIMO_VERSOES_IF_MATCH = 4  # If-Match com mais ETags do que isto recebe 400
+MAXIMA_VERSAO = 2 ** 31 - 1  # Maior valor da coluna versao (INT)
+
+def _valores_atribuicoes(campos):
+    """Parâmetros de ATRIBUICOES_IMOVEL: (informado, valor) para cada campo atualizável"""
+    valores = []
+    for campo in CAMPOS_ATUALIZAVEIS:
+        valores.extend((1, campos[campo]) if campo in campos else (0, None))
+    return valores
+
+def _etag(versao):
+    return f'"{int(versao)}"'
+
+def _versoes_if_match(cabecalho):
+    """
+    Extrai as versões aceitas do cabeçalho If-Match ('"3"' ou '"3", "4"').
+    
+    Retorna None para '*' (qualquer versão) e levanta ValueError se malformado.
+    ETags fracas (W/"3") e fora do intervalo da coluna versao nunca coincidem
+    (If-Match usa comparação forte) e ficam de fora da lista, o que leva a 412.
+    """
+    if cabecalho.strip() == '*':
+        return None
+    versoes = []
+    for etag in cabecalho.split(','):
+        encontrado = re.fullmatch(r'\s*(W/)?"([^"]*)"\s*', etag)
+        if not encontrado:
+            raise ValueError(etag)
+        fraca, valor = encontrado.groups()
+        if not fraca and valor.isascii() and valor.isdigit() and int(valor) <= MAXIMA_VERSAO:
+            versoes.append(int(valor))
+    return versoes
+
+@app.route('/imoveis/<int:id>', methods=['PATCH'])
+def atualizar_parcial_imovel(id):
+    """
+    Atualiza campos de um imóvel em um único UPDATE condicional.
+    
+    Aceita as pré-condições If-Match (versão do ETag) e If-Unmodified-Since
+    (updated_at). Só quando nenhuma linha é afetada uma consulta extra
+    distingue "não encontrado" (404) de "conflito" (412).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'erro': 'Corpo da requisição deve ser um objeto JSON'}), 400
+    
+    campos = {campo: data[campo] for campo in CAMPOS_ATUALIZAVEIS if campo in data}
+    if not campos:
+        return jsonify({'erro': 'Nenhum campo para atualizar'}), 400
+    
+    # Pré-condições ausentes entram na query como "verdadeiro" (indicador 1), para
+    # que o texto seja sempre o mesmo; a lista do If-Match é completada com NULL
+    versoes = None
+    limite = None
+    try:
+        if request.headers.get('If-Match'):
+            versoes = _versoes_if_match(request.headers['If-Match'])
+            if versoes is not None and len(versoes) > MAXIMO_VERSOES_IF_MATCH:
+                raise ValueError(request.headers['If-Match'])
+        
+        if request.headers.get('If-Unmodified-Since'):
+            limite = int(parsedate_to_datetime(request.headers['If-Unmodified-Since']).timestamp())
+    except (TypeError, ValueError):
+        return jsonify({'erro': 'Cabeçalho de pré-condição inválido'}), 400
+    
+    valores = _valores_atribuicoes(campos) + [id]
+    valores.append(1 if versoes is None else 0)
+    valores.extend((versoes or []) + [None] * (MAXIMO_VERSOES_IF_MATCH - len(versoes or [])))
+    valores.extend((1, None) if limite is None else (0, limite))
+    
+    # LAST_INSERT_ID(expr) devolve a nova versão junto com o número de linhas afetadas
+    query = f'''
+        UPDATE imoveis SET {ATRIBUICOES_IMOVEL}, versao = LAST_INSERT_ID(versao + 1)
+        WHERE id = %s
+          AND (%s OR versao IN ({", ".join(["%s"] * MAXIMO_VERSOES_IF_MATCH)}))
+          AND (%s OR UNIX_TIMESTAMP(updated_at) <= %s)
+    '''
+    resultado = _atualizar_imovel(id, query, valores, campos)
+    
+    if resultado is None:
+        return jsonify({'erro': 'Erro ao atualizar imóvel'}), 500
+    
+    linhas, versao = resultado
+    if linhas == 0:
+        atual = execute_query('SELECT versao FROM imoveis WHERE id = %s', (id,))
+        if atual is None:
+            return jsonify({'erro': 'Erro interno do servidor'}), 500
+        if not atual:
+            return jsonify({'erro': 'Imóvel não encontrado'}), 404
+        resposta = jsonify({'erro': 'Imóvel modificado por outra requisição',
+                            'versao': int(atual[0]['versao'])})
+        resposta.status_code = 412
+        resposta.headers['ETag'] = _etag(atual[0]['versao'])
+        return resposta
+    
+    # Prefer: return=representation devolve o imóvel como ficou gravado (valores
+    # convertidos pelo banco, como no GET), ao custo de um SELECT
+    if 'return=representation' in request.headers.get('Prefer', ''):
+        atual = execute_query('SELECT * FROM imoveis WHERE id = %s', (id,))
+        if atual:
+            resposta = jsonify(atual[0])
+            resposta.headers['ETag'] = _etag(atual[0]['versao'])
+            return resposta
+    
+    resposta = jsonify({'mensagem': 'Imóvel atualizado com sucesso', 'versao': versao})
+    resposta.headers['ETag'] = _etag(versao)
+    return resposta
+
 @app.route('/imoveis/<int:id>', methods=['PUT'])
 def atualizar_imovel(id):
     """Atualiza um imóvel existente"""
@@ -101,34 +457,28 @@ def atualizar_imovel(id):
     if not imovel_existente:
         return jsonify({'erro': 'Imóvel não encontrado'}), 404
     
-    # Construir query de atualização dinamicamente
-    campos_update = []
-    valores = []
-    
-    campos_permitidos = ['logradouro', 'tipo_logradouro', 'bairro', 'cidade', 'cep', 'tipo', 'valor', 'data_aquisicao']
-    
-    for campo in campos_permitidos:
-        if campo in data:
-            campos_update.append(f'{campo} = %s')
-            valores.append(data[campo])
-    
-    if not campos_update:
+    campos = {campo: data[campo] for campo in CAMPOS_ATUALIZAVEIS if campo in data}
+    if not campos:
         return jsonify({'erro': 'Nenhum campo para atualizar'}), 400
     
-    valores.append(id)
-    query = f'UPDATE imoveis SET {", ".join(campos_update)} WHERE id = %s'
-    
-    result = execute_query(query, valores)
+    query = f'UPDATE imoveis SET {ATRIBUICOES_IMOVEL}, versao = versao + 1 WHERE id = %s'
+    result = _atualizar_imovel(id, query, _valores_atribuicoes(campos) + [id], campos)
     
     if result is None:
         return jsonify({'erro': 'Erro ao atualizar imóvel'}), 500
-    
     return jsonify({'mensagem': 'Imóvel atualizado com sucesso'})
 
 @app.route('/imoveis/<int:id>', methods=['DELETE'])
 def deletar_imovel(id):
     """Remove um imóvel"""
-    result = execute_query('DELETE FROM imoveis WHERE id = %s', (id,))
+    # Registrar a remoção junto com o DELETE para que o feed de alterações a entregue;
+    # tipo e cidade são lidos na mesma transação para atualizar os contadores
+    resultados = execute_transaction([
+        ('SELECT tipo, cidade FROM imoveis WHERE id = %s FOR UPDATE', (id,)),
+        ('REPLACE INTO imoveis_removidos (id) SELECT id FROM imoveis WHERE id = %s', (id,)),
+        ('DELETE FROM imoveis WHERE id = %s', (id,))
+    ])
+    result = resultados[-1] if resultados is not None else None
     
     if result is None:
         return jsonify({'erro': 'Erro interno do servidor'}), 500
@@ -136,27 +486,194 @@ def deletar_imovel(id):
     if result == 0:
         return jsonify({'erro': 'Imóvel não encontrado'}), 404
     
+    removido = resultados[0][0]
+    contadores.registrar_remocao(removido['tipo'], removido['cidade'])
+    _registrar_escrita()
     return jsonify({'mensagem': 'Imóvel removido com sucesso'})
 
 @app.route('/imoveis/tipo/<tipo>', methods=['GET'])
 def listar_por_tipo(tipo):
     """Lista imóveis por tipo"""
-    imoveis = execute_query('SELECT * FROM imoveis WHERE tipo = %s ORDER BY id', (tipo,))
+    paginacao = _paginacao()
+    if paginacao is None:
+        return jsonify({'erro': 'Parâmetros limit e offset devem ser inteiros positivos'}), 400
     
-    if imoveis is None:
-        return jsonify({'erro': 'Erro interno do servidor'}), 500
-    
-    return jsonify(imoveis)
+    query, params = _consulta_paginada('SELECT * FROM imoveis WHERE tipo = %s ORDER BY id', (tipo,), *paginacao)
+    resposta = _resposta_coalescida(query, params, _lista_ou_erro)
+    return _definir_total(resposta, tipo=tipo) if paginacao[0] is not None else resposta
 
 @app.route('/imoveis/cidade/<cidade>', methods=['GET'])
 def listar_por_cidade(cidade):
     """Lista imóveis por cidade"""
-    imoveis = execute_query('SELECT * FROM imoveis WHERE cidade = %s ORDER BY id', (cidade,))
+    paginacao = _paginacao()
+    if paginacao is None:
+        return jsonify({'erro': 'Parâmetros limit e offset devem ser inteiros positivos'}), 400
     
-    if imoveis is None:
+    query, params = _consulta_paginada('SELECT * FROM imoveis WHERE cidade = %s ORDER BY id', (cidade,), *paginacao)
+    resposta = _resposta_coalescida(query, params, _lista_ou_erro)
+    return _definir_total(resposta, cidade=cidade) if paginacao[0] is not None else resposta
+
+@app.route('/imoveis/changes', methods=['GET'])
+def listar_alteracoes():
+    """Lista alterações (criações, atualizações e remoções) desde o token informado"""
+    try:
+        limite = int(request.args.get('limit', alteracoes.TAMANHO_PAGINA_PADRAO))
+        espera = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'erro': 'Parâmetros limit e wait devem ser numéricos'}), 400
+    
+    if limite < 1 or not math.isfinite(espera) or espera < 0:
+        return jsonify({'erro': 'Parâmetros limit e wait devem ser positivos'}), 400
+    
+    # O long-polling termina antes do prazo da requisição
+    restante = tempo_restante()
+    if restante is not None:
+        espera = max(0, min(espera, restante - 1))
+    
+    try:
+        pagina = alteracoes.aguardar_pagina(request.args.get('since'),
+                                            min(limite, alteracoes.TAMANHO_PAGINA_MAXIMO),
+                                            espera)
+    except alteracoes.TokenInvalido:
+        return jsonify({'erro': 'Token since inválido'}), 400
+    
+    if pagina is None:
         return jsonify({'erro': 'Erro interno do servidor'}), 500
     
-    return jsonify(imoveis)
+    return jsonify(pagina)
+
+def _filtros_exportacao(origem):
+    """Extrai os filtros de exportação (tipo, cidade) de um dicionário"""
+    return {campo: origem.get(campo) for campo in exportar.FILTROS if origem.get(campo)}
+
+def _tamanho_lote(valor):
+    """Converte o tamanho de lote informado, retornando None se inválido"""
+    try:
+        lote = int(valor) if valor is not None else exportar.TAMANHO_LOTE_PADRAO
+    except (TypeError, ValueError):
+        return None
+    return lote if lote > 0 else None
+
+@app.route('/imoveis/export', methods=['GET'])
+def exportar_imoveis():
+    """Exporta os imóveis (opcionalmente filtrados) em CSV, NDJSON ou Parquet via streaming"""
+    formato = request.args.get('formato', 'csv')
+    lote = _tamanho_lote(request.args.get('lote'))
+    if lote is None:
+        return jsonify({'erro': 'Parâmetro lote deve ser um inteiro positivo'}), 400
+    
+    try:
+        exportar.verificar_formato(formato)
+    except exportar.FormatoIndisponivel as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    blocos = exportar.gerar_exportacao(formato, _filtros_exportacao(request.args), lote)
+    try:
+        # Ler o primeiro bloco antes de responder para que falhas de conexão virem 500
+        primeiro = next(blocos, b'')
+    except Error as e:
+        print(f"Erro ao exportar imóveis: {e}")
+        return jsonify({'erro': 'Erro ao exportar imóveis'}), 500
+    
+    def transmitir():
+        yield primeiro
+        yield from blocos
+    
+    info = exportar.FORMATOS[formato]
+    return Response(transmitir(), mimetype=info['mimetype'], headers={
+        'Content-Disposition': f"attachment; filename=imoveis.{info['extensao']}"
+    })
+
+@app.route('/imoveis/export/jobs', methods=['POST'])
+def criar_exportacao():
+    """Inicia uma exportação em segundo plano gravada em arquivo local"""
+    data = request.get_json(silent=True) or {}
+    lote = _tamanho_lote(data.get('lote'))
+    if lote is None:
+        return jsonify({'erro': 'Campo lote deve ser um inteiro positivo'}), 400
+    
+    try:
+        trabalho = exportar.iniciar_trabalho(data.get('formato', 'csv'), _filtros_exportacao(data), lote)
+    except exportar.FormatoIndisponivel as e:
+        return jsonify({'erro': str(e)}), 400
+    except exportar.FilaCheia:
+        resposta = jsonify({'erro': 'Exportações demais em andamento, tente novamente mais tarde'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '30'
+        return resposta
+    
+    return jsonify(trabalho), 202
+
+@app.route('/imoveis/export/jobs/<trabalho_id>', methods=['GET'])
+def obter_exportacao(trabalho_id):
+    """Consulta o status de uma exportação em segundo plano"""
+    trabalho = exportar.obter_trabalho(trabalho_id)
+    if trabalho is None:
+        return jsonify({'erro': 'Exportação não encontrada'}), 404
+    
+    return jsonify(trabalho)
+
+@app.route('/imoveis/export/jobs/<trabalho_id>/download', methods=['GET'])
+def baixar_exportacao(trabalho_id):
+    """Baixa o arquivo de uma exportação concluída"""
+    trabalho = exportar.obter_trabalho(trabalho_id)
+    if trabalho is None:
+        return jsonify({'erro': 'Exportação não encontrada'}), 404
+    
+    if trabalho['status'] != 'concluido':
+        return jsonify({'erro': 'Exportação ainda não concluída', 'status': trabalho['status']}), 409
+    
+    info = exportar.FORMATOS[trabalho['formato']]
+    return send_file(os.path.abspath(trabalho['arquivo']), mimetype=info['mimetype'],
+                     as_attachment=True, download_name=f"imoveis.{info['extensao']}")
+
+def _parametros_analise(agrupar=True):
+    """Lê agrupamento e filtros das análises, retornando (por, filtros) ou levanta ValueError"""
+    por = request.args.get('por', 'cidade')
+    if agrupar and por not in analise.AGRUPAMENTOS:
+        raise ValueError(f'Parâmetro por deve ser um de: {", ".join(analise.AGRUPAMENTOS)}')
+    
+    filtros = {campo: request.args.get(campo) for campo in analise.FILTROS if request.args.get(campo)}
+    if 'ano' in filtros:
+        if not filtros['ano'].isdigit():
+            raise ValueError('Parâmetro ano deve ser numérico')
+        filtros['ano'] = int(filtros['ano'])
+    return por, filtros
+
+def _resposta_analise(calcular):
+    try:
+        return jsonify(calcular())
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except analise.ErroAnalise:
+        return jsonify({'erro': 'Erro interno do servidor'}), 500
+
+@app.route('/imoveis/analise/valores', methods=['GET'])
+def analisar_valores():
+    """Quantidade, média, mínimo, p10, mediana, p90 e máximo de valor por cidade, tipo ou ano"""
+    def calcular():
+        por, filtros = _parametros_analise()
+        return {'por': por, 'filtros': filtros, 'grupos': analises.valores(por, filtros)}
+    return _resposta_analise(calcular)
+
+@app.route('/imoveis/analise/histograma', methods=['GET'])
+def analisar_histograma():
+    """Histograma de valor por cidade, tipo ou ano, com faixas comuns a todos os grupos"""
+    def calcular():
+        por, filtros = _parametros_analise()
+        faixas = request.args.get('faixas', str(analise.FAIXAS_PADRAO))
+        if not faixas.isdigit() or not 1 <= int(faixas) <= analise.FAIXAS_MAXIMO:
+            raise ValueError(f'Parâmetro faixas deve estar entre 1 e {analise.FAIXAS_MAXIMO}')
+        return {'por': por, 'filtros': filtros, **analises.histograma(por, filtros, int(faixas))}
+    return _resposta_analise(calcular)
+
+@app.route('/imoveis/analise/tendencia', methods=['GET'])
+def analisar_tendencia():
+    """Mediana de valor por ano de aquisição e variação em relação ao ano anterior"""
+    def calcular():
+        _, filtros = _parametros_analise(agrupar=False)
+        return {'filtros': filtros, 'anos': analises.tendencia(filtros)}
+    return _resposta_analise(calcular)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -164,33 +681,41 @@ def health_check():
     if test_connection():
         return jsonify({
             'status': 'OK',
-            'database': 'MySQL Connected',
+            'database': f'{NOME_BANCO} Connected',
             'message': 'API funcionando corretamente'
         })
     else:
         return jsonify({
             'status': 'ERROR',
-            'database': 'MySQL Disconnected',
+            'database': f'{NOME_BANCO} Disconnected',
             'message': 'Problema na conexão com o banco'
         }), 500
 
+# Tabelas e estrutura não mudam com a aplicação no ar: consultadas uma vez por processo
+_estrutura_banco = {}
+
 @app.route('/debug', methods=['GET'])
 def debug_database():
     """Endpoint de debug para verificar o banco"""
     try:
-        # Verificar se a tabela existe
-        tables = execute_query("SHOW TABLES")
-        
-        # Contar registros na tabela imoveis
-        count = execute_query("SELECT COUNT(*) as total FROM imoveis")
+        if not _estrutura_banco:
+            # Verificar se a tabela existe e mostrar sua estrutura (consulta própria de cada banco)
+            estrutura = estrutura_banco()
+            if estrutura is not None:
+                _estrutura_banco.update(tabelas=estrutura[0], estrutura_tabela=estrutura[1])
         
-        # Mostrar estrutura da tabela
-        structure = execute_query("DESCRIBE imoveis")
+        # Total de registros vindo dos contadores em memória, sem COUNT(*)
+        total = contadores.contar()
         
         return jsonify({
-            'tabelas': tables,
-            'total_imoveis': count,
-            'estrutura_tabela': structure,
+            'tabelas': _estrutura_banco.get('tabelas'),
+            'total_imoveis': [{'total': total}] if total is not None else None,
+            'estrutura_tabela': _estrutura_banco.get('estrutura_tabela'),
+            'contagem': contadores.estatisticas(),
+            'admissao': controle_admissao.estatisticas() if controle_admissao else None,
+            'coalescencia': coalescedor.estatisticas(),
+            'gravacao_em_grupo': fila_gravacao.estatisticas() if fila_gravacao else None,
+            'banco': estatisticas_banco(),
             'status': 'OK'
         })
     except Exception as e:
@@ -0,0 +1,31 @@
+"""
+Banco de dados usado pela aplicação
+
+DB_BACKEND=mysql (padrão) usa database_mysql; DB_BACKEND=sqlite usa um banco
+SQLite em memória (database_sqlite), que permite rodar a API e os testes sem um
+servidor MySQL. Os dois módulos têm a mesma interface, reexportada aqui.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+
+if BACKEND == 'sqlite':
+    from database_sqlite import (Error, NOME_BANCO, prazo_atual, classe_atual, tempo_restante,
+                                 observadores_latencia, init_db, clear_db, test_connection, execute_query, execute_update,
+                                 execute_insert_many, execute_transaction, stream_query,
+                                 estatisticas_banco, estrutura_banco, chave_comparacao,
+                                 iniciar_transacao_teste, desfazer_transacao_teste)
+elif BACKEND == 'mysql':
+    from mysql.connector import Error
+    from database_mysql import (NOME_BANCO, prazo_atual, classe_atual, tempo_restante,
+                                observadores_latencia, init_db, clear_db, test_connection, execute_query, execute_update,
+                                execute_insert_many, execute_transaction, stream_query,
+                                estatisticas_banco, estrutura_banco, chave_comparacao,
+                                iniciar_transacao_teste, desfazer_transacao_teste)
+else:
+    raise ImportError(f'DB_BACKEND inválido: {BACKEND} (use mysql ou sqlite)')
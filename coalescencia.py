@@ -0,0 +1,114 @@
+"""
+Coalescência de leituras idênticas simultâneas (single-flight)
+
+Em picos, muitos clientes pedem o mesmo /imoveis/<id> ou /imoveis/cidade/<cidade>
+ao mesmo tempo. Em vez de cada requisição executar o mesmo SELECT em sua própria
+conexão, a primeira (líder) executa a consulta e as demais que chegam enquanto
+ela está em andamento aguardam e recebem o mesmo resultado já serializado.
+
+Nada é guardado depois que a chamada termina: isto não é um cache. Escritas
+(invalidar) fazem com que novas leituras não se juntem a uma consulta iniciada
+antes delas. Se a execução compartilhada falhar (por exemplo, pelo prazo mais
+curto do líder), quem aguardava e ainda tem tempo tenta mais uma vez em vez de
+herdar a falha.
+"""
+
+import threading
+import time
+
+
+class TempoEsgotado(Exception):
+    """O resultado da consulta compartilhada não ficou pronto dentro do prazo"""
+
+
+class _Chamada:
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+def normalizar_chave(query, params=None):
+    """Chave de coalescência: SQL com espaços normalizados e parâmetros"""
+    return ' '.join(query.split()), tuple(params or ())
+
+
+class SingleFlight:
+    """Compartilha uma única execução entre chamadas simultâneas com a mesma chave"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chamadas = {}
+        self._geracao = 0
+        self.executadas = 0
+        self.coalescidas = 0
+        self.repetidas = 0
+        self.tempo_esgotado = 0
+
+    def invalidar(self):
+        """Após uma escrita, novas chamadas não aproveitam execuções já em andamento"""
+        with self._lock:
+            self._geracao += 1
+
+    def executar(self, chave, funcao, timeout=None, falhou=None):
+        """
+        Executa funcao() ou aguarda a execução em andamento para a mesma chave.
+
+        Retorna (resultado, coalescida). Quem aguarda recebe o mesmo objeto de
+        resultado, que portanto não deve ser modificado. Levanta TempoEsgotado
+        se o resultado não ficar pronto em timeout segundos.
+
+        Se a execução aguardada levantar uma exceção (ou falhou(resultado) for
+        verdadeiro) antes do fim do timeout, quem aguardava tenta uma segunda
+        vez, executando ou se juntando a uma nova execução.
+        """
+        prazo = None if timeout is None else time.monotonic() + timeout
+        repetir = True
+        while True:
+            with self._lock:
+                chave_geracao = (self._geracao, chave)
+                chamada = self._chamadas.get(chave_geracao)
+                lider = chamada is None
+                if lider:
+                    chamada = self._chamadas[chave_geracao] = _Chamada()
+                    self.executadas += 1
+                else:
+                    self.coalescidas += 1
+
+            if lider:
+                try:
+                    chamada.resultado = funcao()
+                except Exception as e:
+                    chamada.erro = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._chamadas[chave_geracao]
+                    chamada.concluida.set()
+                return chamada.resultado, False
+
+            restante = None if prazo is None else max(0, prazo - time.monotonic())
+            if not chamada.concluida.wait(restante):
+                with self._lock:
+                    self.tempo_esgotado += 1
+                raise TempoEsgotado(chave)
+
+            falha = chamada.erro is not None or (falhou is not None and falhou(chamada.resultado))
+            if falha and repetir and (prazo is None or time.monotonic() < prazo):
+                repetir = False
+                with self._lock:
+                    self.repetidas += 1
+                continue
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado, True
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'executadas': self.executadas,
+                'coalescidas': self.coalescidas,
+                'repetidas': self.repetidas,
+                'tempo_esgotado': self.tempo_esgotado,
+                'em_andamento': len(self._chamadas),
+            }
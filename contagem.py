@@ -0,0 +1,135 @@
+"""
+Contadores de imóveis mantidos em memória
+
+Evita um SELECT COUNT(*) (varredura de índice no InnoDB) a cada listagem: os
+totais geral, por tipo e por cidade são carregados com um único GROUP BY e
+depois atualizados a cada criação, atualização e remoção feita pela API (que
+informa o tipo e a cidade anteriores, lidos na mesma transação da escrita). Os
+valores são agrupados pela chave com que a collation do banco os compara
+(chave_comparacao), para que 'sao paulo' conte os imóveis de 'São Paulo' como o
+WHERE da listagem. Uma thread recarrega os totais a cada CONTAGEM_RECONCILIAR
+segundos, o que corrige gravações feitas por outros workers; a consulta roda
+fora do lock, sem bloquear as contagens.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+
+from banco import chave_comparacao, execute_query
+
+INTERVALO_RECONCILIACAO = float(os.getenv('CONTAGEM_RECONCILIAR', 60))
+
+
+class Contadores:
+    """Totais de imóveis (geral, por tipo e por cidade) atualizados incrementalmente"""
+
+    def __init__(self, intervalo_reconciliacao=INTERVALO_RECONCILIACAO):
+        self.intervalo_reconciliacao = intervalo_reconciliacao
+        self._lock = threading.Lock()
+        self._recarga = threading.Lock()  # Uma recarga do banco por vez
+        self._total = None
+        self._por_tipo = Counter()
+        self._por_cidade = Counter()
+        self._reconciliado_em = 0.0
+        self.reconciliacoes = 0
+
+    def iniciar(self):
+        """Inicia a thread de reconciliação periódica e retorna os próprios contadores"""
+        threading.Thread(target=self._reconciliar_periodicamente, name='contagem', daemon=True).start()
+        return self
+
+    def _reconciliar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo_reconciliacao)
+            self._reconciliar()
+
+    def _reconciliar(self, so_se_invalido=False):
+        """Recarrega os totais do banco; retorna False em caso de erro"""
+        with self._recarga:
+            if so_se_invalido and self._total is not None:
+                return True  # Carregados por quem tinha a recarga antes
+            grupos = execute_query('SELECT tipo, cidade, COUNT(*) AS total FROM imoveis GROUP BY tipo, cidade')
+            if grupos is None:
+                return False
+
+            por_tipo = Counter()
+            por_cidade = Counter()
+            for grupo in grupos:
+                por_tipo[chave_comparacao(grupo['tipo'])] += int(grupo['total'])
+                por_cidade[chave_comparacao(grupo['cidade'])] += int(grupo['total'])
+
+            # Escritas registradas durante a consulta podem ou não estar nela: o
+            # erro de no máximo uma por escrita some na próxima reconciliação
+            with self._lock:
+                self._por_tipo = por_tipo
+                self._por_cidade = por_cidade
+                self._total = sum(por_tipo.values())
+                self._reconciliado_em = time.monotonic()
+                self.reconciliacoes += 1
+            return True
+
+    def invalidar(self):
+        """Força a recarga do banco na próxima contagem"""
+        with self._lock:
+            self._total = None
+
+    def contar(self, tipo=None, cidade=None):
+        """Total estimado de imóveis (com filtro opcional por tipo ou cidade), ou None em caso de erro"""
+        with self._lock:
+            carregado = self._total is not None
+        # Só a primeira contagem (ou a seguinte a invalidar) espera pelo banco
+        if not carregado and not self._reconciliar(so_se_invalido=True):
+            return None
+        with self._lock:
+            if tipo is not None:
+                return self._por_tipo[chave_comparacao(tipo)]
+            if cidade is not None:
+                return self._por_cidade[chave_comparacao(cidade)]
+            return self._total
+
+    def _somar(self, tipo, cidade, quantidade):
+        # Chamado com self._lock adquirido
+        self._por_tipo[chave_comparacao(tipo)] += quantidade
+        self._por_cidade[chave_comparacao(cidade)] += quantidade
+
+    def registrar_criacao(self, tipo, cidade):
+        with self._lock:
+            if self._total is not None:
+                self._total += 1
+                self._somar(tipo, cidade, 1)
+
+    def registrar_remocao(self, tipo, cidade):
+        with self._lock:
+            if self._total is not None:
+                self._total -= 1
+                self._somar(tipo, cidade, -1)
+
+    def registrar_atualizacao(self, anterior, atual):
+        """Move um imóvel entre totais; anterior e atual são pares (tipo, cidade)"""
+        with self._lock:
+            if self._total is not None:
+                self._somar(*anterior, -1)
+                self._somar(*atual, 1)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'total': self._total,
+                'segundos_desde_reconciliacao': (round(time.monotonic() - self._reconciliado_em, 1)
+                                                 if self._total is not None else None),
+                'reconciliacoes': self.reconciliacoes,
+            }
+
+def contar_exato(tipo=None, cidade=None):
+    """SELECT COUNT(*) com o filtro informado, ou None em caso de erro"""
+    if tipo is not None:
+        resultado = execute_query('SELECT COUNT(*) AS total FROM imoveis WHERE tipo = %s', (tipo,))
+    elif cidade is not None:
+        resultado = execute_query('SELECT COUNT(*) AS total FROM imoveis WHERE cidade = %s', (cidade,))
+    else:
+        resultado = execute_query('SELECT COUNT(*) AS total FROM imoveis')
+    if resultado is None:
+        return None
+    return int(resultado[0]['total'])
@@ -1,13 +1,63 @@
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, InterfaceError, OperationalError
+import math
 import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dotenv import load_dotenv
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
+NOME_BANCO = 'MySQL'
+
+# Prazo (time.monotonic) da requisição atual, definido pelo controle de admissão
+prazo_atual = ContextVar('prazo_atual', default=None)
+
+# Classe de admissão da requisição atual ('leitura', 'escrita', ...), ou None fora de requisições
+classe_atual = ContextVar('classe_atual', default=None)
+
+# Funções chamadas com a duração (em segundos) de cada acesso ao banco
+observadores_latencia = []
+
+def tempo_restante():
+    """Segundos restantes até o prazo da requisição atual, ou None se não houver prazo"""
+    prazo = prazo_atual.get()
+    if prazo is None:
+        return None
+    return prazo - time.monotonic()
+
+def _registrar_latencia(inicio):
+    """Informa aos observadores a duração de um acesso ao banco"""
+    duracao = time.monotonic() - inicio
+    for observador in observadores_latencia:
+        observador(duracao)
+
+def _limitar_execucao(query):
+    """Acrescenta o hint MAX_EXECUTION_TIME a um SELECT quando a requisição tem prazo"""
+    restante = tempo_restante()
+    query = query.lstrip()
+    if restante is None or not query.upper().startswith('SELECT'):
+        return query
+    # Arredondado para baixo a uma potência de 2 em segundos: poucos textos
+    # distintos por query, para que o cache de prepared statements seja reaproveitado
+    milissegundos = 2 ** int(math.log2(max(1, restante))) * 1000
+    return f'{query[:6]} /*+ MAX_EXECUTION_TIME({milissegundos}) */{query[6:]}'
+
 def get_db_connection(test_db=False):
     """Cria uma conexão com o banco de dados MySQL"""
+    opcoes = {}
+    restante = tempo_restante()
+    if restante is not None:
+        if restante <= 0:
+            print("Erro ao conectar ao MySQL: prazo da requisição esgotado")
+            return None
+        opcoes['connection_timeout'] = math.ceil(restante)
+    
     try:
         connection = mysql.connector.connect(
             host=os.getenv('MYSQL_HOST'),
@@ -16,7 +66,8 @@ def get_db_connection(test_db=False):
             password=os.getenv('MYSQL_PASSWORD'),
             database=os.getenv('MYSQL_TEST_DATABASE' if test_db else 'MYSQL_DATABASE'),
             charset=os.getenv('MYSQL_CHARSET', 'utf8mb4'),
-            autocommit=True
+            autocommit=True,
+            **opcoes
         )
         return connection
     except Error as e:
@@ -42,11 +93,29 @@ def init_db(test_db=False):
                 tipo VARCHAR(50),
                 valor DECIMAL(15,2),
                 data_aquisicao DATE,
+                versao INT NOT NULL DEFAULT 1,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
         ''')
         
+        # Registro de remoções para o feed de alterações (/imoveis/changes)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imoveis_removidos (
+                id INT PRIMARY KEY,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_deleted_at (deleted_at, id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        ''')
+        
+        # Versão usada no controle de concorrência otimista (tabelas antigas não a possuem)
+        if not _coluna_existe(cursor, 'imoveis', 'versao'):
+            cursor.execute('ALTER TABLE imoveis ADD COLUMN versao INT NOT NULL DEFAULT 1 AFTER data_aquisicao')
+        
+        # Índice usado pelo feed de alterações (tabelas antigas não o possuem)
+        if not _indice_existe(cursor, 'imoveis', 'idx_updated_at'):
+            cursor.execute('CREATE INDEX idx_updated_at ON imoveis (updated_at, id)')
+        
         print("Tabela 'imoveis' criada com sucesso!")
         return True
         
@@ -67,6 +136,7 @@ def clear_db(test_db=False):
     try:
         cursor = connection.cursor()
         cursor.execute('DELETE FROM imoveis')
+        cursor.execute('DELETE FROM imoveis_removidos')
         cursor.execute('ALTER TABLE imoveis AUTO_INCREMENT = 1')  # Reset auto increment
         return True
         
@@ -78,38 +148,453 @@ def clear_db(test_db=False):
             cursor.close()
             connection.close()
 
+def _indice_existe(cursor, tabela, indice):
+    """Verifica se um índice já existe na tabela do banco atual"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    ''', (tabela, indice))
+    return cursor.fetchone()[0] > 0
+
+def _coluna_existe(cursor, tabela, coluna):
+    """Verifica se uma coluna já existe na tabela do banco atual"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    ''', (tabela, coluna))
+    return cursor.fetchone()[0] > 0
+
+def _converter_linha(row):
+    """Converte Decimal para float para consistência com JSON"""
+    for key, value in row.items():
+        if hasattr(value, '__float__'):  # Se é um tipo numérico (como Decimal)
+            try:
+                row[key] = float(value)
+            except (ValueError, TypeError):
+                pass  # Manter o valor original se não conseguir converter
+    return row
+
+def chave_comparacao(texto):
+    """Forma de texto com que a collation da tabela (utf8mb4_0900_ai_ci) compara valores
+
+    Sem distinção de maiúsculas nem de acentos: 'São Paulo' = 'sao paulo'.
+    """
+    if texto is None:
+        return None
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+# Pool de conexões com cache de prepared statements por conexão
+
+TAMANHO_POOL = int(os.getenv('MYSQL_POOL_SIZE', 10))
+ESPERA_POOL = float(os.getenv('MYSQL_POOL_TIMEOUT', 10))  # segundos, quando a requisição não tem prazo
+OCIOSIDADE_MAXIMA = 30  # segundos sem uso antes de verificar se a conexão ainda está viva
+TAMANHO_CACHE_STATEMENTS = int(os.getenv('MYSQL_STATEMENT_CACHE_SIZE', 32))
+
+# Conexões reservadas a cada classe de admissão (MYSQL_POOL_RESERVA_LEITURA, ...):
+# uma classe nunca ocupa as conexões reservadas às outras e ainda não usadas, então
+# escritas e lotes não deixam as leituras sem conexão. O restante é compartilhado,
+# inclusive com o trabalho feito fora de requisições (classe None).
+RESERVAS_POOL = {
+    classe: int(os.getenv(f'MYSQL_POOL_RESERVA_{classe.upper()}', padrao))
+    for classe, padrao in {'leitura': 3, 'escrita': 2, 'lote': 1, 'alteracoes': 1}.items()
+}
+
+_estatisticas_statements = {'acertos': 0, 'falhas': 0, 'descartes': 0}
+_estatisticas_lock = threading.Lock()
+
+def _contar_statement(evento):
+    with _estatisticas_lock:
+        _estatisticas_statements[evento] += 1
+
+class _ConexaoPool:
+    """Conexão do pool com seu cache LRU de prepared statements"""
+    
+    def __init__(self, connection, transacao_externa=False):
+        self.connection = connection
+        self.transacao_externa = transacao_externa  # Já dentro da transação dos testes
+        self.ultimo_uso = time.monotonic()
+        self.classe = None  # Classe de admissão de quem a tomou emprestada do pool
+        self._statements = OrderedDict()  # texto da query -> (texto, cursor preparado)
+    
+    def _cursor_preparado(self, query):
+        # O cursor só reaproveita o statement se receber o mesmo objeto str,
+        # por isso o texto guardado no cache é o que vai para execute()
+        if query in self._statements:
+            self._statements.move_to_end(query)
+            _contar_statement('acertos')
+            return self._statements[query]
+        
+        _contar_statement('falhas')
+        item = (query, self.connection.cursor(prepared=True, dictionary=True))
+        self._statements[query] = item
+        if len(self._statements) > TAMANHO_CACHE_STATEMENTS:
+            _, (_, antigo) = self._statements.popitem(last=False)
+            antigo.close()  # Libera o statement no servidor
+            _contar_statement('descartes')
+        return item
+    
+    def executar(self, query, params=None, preparar=True):
+        """
+        Executa a query e retorna (linhas ou None, linhas afetadas, último id).
+        
+        Queries com parâmetros usam o prepared statement em cache; sem
+        parâmetros (ou com preparar=False) usam um cursor comum.
+        """
+        if params and preparar:
+            texto, cursor = self._cursor_preparado(query)
+            cursor.execute(texto, params)
+            linhas = cursor.fetchall() if cursor.description else None
+            return linhas, cursor.rowcount, cursor.lastrowid
+        
+        cursor = self.connection.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params or ())
+            linhas = cursor.fetchall() if cursor.description else None
+            return linhas, cursor.rowcount, cursor.lastrowid
+        finally:
+            cursor.close()
+    
+    @contextmanager
+    def transacao(self):
+        """Transação própria ou, dentro da transação dos testes, um savepoint"""
+        if self.transacao_externa:
+            self.executar('SAVEPOINT transacao')
+            try:
+                yield
+            except BaseException:  # Não devolver ao pool uma transação aberta
+                self.executar('ROLLBACK TO SAVEPOINT transacao')
+                raise
+            else:
+                self.executar('RELEASE SAVEPOINT transacao')
+            return
+        
+        self.connection.start_transaction()
+        try:
+            yield
+        except BaseException:  # Não devolver ao pool uma transação aberta
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+    
+    def fechar(self):
+        try:
+            for _, cursor in self._statements.values():
+                cursor.close()
+            self.connection.close()
+        except Error:
+            pass
+
+class _Pool:
+    """
+    Pool de conexões limitado, com conexões reservadas por classe de admissão.
+    
+    Quem não encontra conexão disponível para a sua classe espera até o prazo da requisição.
+    """
+    
+    def __init__(self, test_db, tamanho, reservas):
+        self.test_db = test_db
+        self.tamanho = tamanho
+        self.reservas = reservas
+        self._livres = []
+        self._criadas = 0
+        self._em_uso = {}  # classe -> conexões emprestadas
+        self._condicao = threading.Condition()
+    
+    def _disponivel(self, classe):
+        # Chamado com self._condicao adquirida
+        em_uso = sum(self._em_uso.values())
+        if em_uso >= self.tamanho:
+            return False
+        if self._em_uso.get(classe, 0) < self.reservas.get(classe, 0):
+            return True
+        reservadas_outras = sum(max(0, reserva - self._em_uso.get(outra, 0))
+                                for outra, reserva in self.reservas.items() if outra != classe)
+        return self.tamanho - em_uso > reservadas_outras
+    
+    def obter(self):
+        classe = classe_atual.get()
+        restante = tempo_restante()
+        prazo = time.monotonic() + (restante if restante is not None else ESPERA_POOL)
+        
+        with self._condicao:
+            while not self._disponivel(classe):
+                espera = prazo - time.monotonic()
+                if espera <= 0:
+                    print("Erro ao conectar ao MySQL: nenhuma conexão livre no pool")
+                    return None
+                self._condicao.wait(espera)
+            
+            self._em_uso[classe] = self._em_uso.get(classe, 0) + 1
+            if self._livres:
+                conexao = self._livres.pop()  # A mais recente, que tem mais chance de estar viva
+            else:
+                conexao = None
+                self._criadas += 1
+        
+        if conexao is None:
+            connection = get_db_connection(self.test_db)
+            if connection is None:
+                self._liberar_vaga(classe)
+                return None
+            conexao = _ConexaoPool(connection)
+        
+        conexao.classe = classe
+        if time.monotonic() - conexao.ultimo_uso > OCIOSIDADE_MAXIMA and not conexao.connection.is_connected():
+            self.descartar(conexao)
+            return self.obter()
+        return conexao
+    
+    def devolver(self, conexao):
+        conexao.ultimo_uso = time.monotonic()
+        with self._condicao:
+            self._em_uso[conexao.classe] -= 1
+            self._livres.append(conexao)
+            # Cada classe espera por uma condição diferente: acordar todas
+            self._condicao.notify_all()
+    
+    def descartar(self, conexao):
+        conexao.fechar()
+        self._liberar_vaga(conexao.classe)
+    
+    def _liberar_vaga(self, classe):
+        with self._condicao:
+            self._em_uso[classe] -= 1
+            self._criadas -= 1
+            self._condicao.notify_all()
+    
+    def estatisticas(self):
+        with self._condicao:
+            return {'conexoes': self._criadas, 'livres': len(self._livres), 'tamanho': self.tamanho,
+                    'em_uso': {str(classe): total for classe, total in self._em_uso.items() if total},
+                    'reservas': self.reservas}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(test_db=False):
+    with _pools_lock:
+        if test_db not in _pools:
+            _pools[test_db] = _Pool(test_db, TAMANHO_POOL, RESERVAS_POOL)
+        return _pools[test_db]
+
+@contextmanager
+def _conexao(test_db=False):
+    """
+    Empresta uma conexão do pool (None se não houver) e a devolve ao final.
+    
+    Conexões com erro de comunicação são descartadas em vez de devolvidas.
+    Durante um teste, todas as chamadas usam a conexão da transação do teste.
+    """
+    if _conexao_teste is not None:
+        with _conexao_teste_lock:
+            yield _conexao_teste
+        return
+    
+    pool = _pool(test_db)
+    conexao = pool.obter()
+    if conexao is None:
+        yield None
+        return
+    
+    try:
+        yield conexao
+    except (InterfaceError, OperationalError):
+        pool.descartar(conexao)
+        raise
+    except BaseException:
+        pool.devolver(conexao)
+        raise
+    else:
+        pool.devolver(conexao)
+
+# Conexão de iniciar_transacao_teste, usada no lugar do pool até desfazer_transacao_teste
+_conexao_teste = None
+_conexao_teste_lock = threading.RLock()
+
+def iniciar_transacao_teste(test_db=False):
+    """
+    Abre a transação que envolve um teste.
+    
+    Até desfazer_transacao_teste, todas as queries (de qualquer thread) usam a
+    mesma conexão, e as transações da aplicação viram savepoints dentro dela.
+    """
+    global _conexao_teste
+    connection = get_db_connection(test_db)
+    if connection is None:
+        raise Error('Não foi possível conectar ao banco de dados MySQL')
+    connection.start_transaction()
+    _conexao_teste = _ConexaoPool(connection, transacao_externa=True)
+
+def desfazer_transacao_teste(test_db=False):
+    """Desfaz tudo o que foi gravado desde iniciar_transacao_teste"""
+    global _conexao_teste
+    with _conexao_teste_lock:
+        conexao, _conexao_teste = _conexao_teste, None
+    if conexao is not None:
+        conexao.connection.rollback()
+        conexao.fechar()
+
+def estatisticas_banco():
+    """Uso do pool de conexões e taxa de acerto do cache de prepared statements"""
+    with _estatisticas_lock:
+        statements = dict(_estatisticas_statements)
+    consultas = statements['acertos'] + statements['falhas']
+    statements['taxa_acerto'] = round(statements['acertos'] / consultas, 4) if consultas else None
+    with _pools_lock:
+        pools = {('teste' if test_db else 'principal'): pool.estatisticas() for test_db, pool in _pools.items()}
+    return {'pool': pools, 'statements': statements}
+
+def _resultado(query, linhas, rowcount, lastrowid):
+    """Resultado no formato de execute_query: linhas para SELECT, senão último id ou linhas afetadas"""
+    if query.strip().upper().startswith('SELECT'):
+        return [_converter_linha(row) for row in linhas]
+    return lastrowid if lastrowid else rowcount
+
 def execute_query(query, params=None, test_db=False):
     """Executa uma query no banco de dados"""
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as conexao:
+            if conexao is None:
+                return None
+            return _resultado(query, *conexao.executar(_limitar_execucao(query), params))
+    except Error as e:
+        print(f"Erro ao executar query: {e}")
+        return None
+    finally:
+        _registrar_latencia(inicio)
+
+def execute_update(query, params=None, test_db=False):
+    """Executa um UPDATE/DELETE e retorna (linhas afetadas, LAST_INSERT_ID), ou None em caso de erro
+
+    Com SET coluna = LAST_INSERT_ID(expr), o valor gravado volta no segundo item
+    sem precisar de outro SELECT.
+    """
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as conexao:
+            if conexao is None:
+                return None
+            _, rowcount, lastrowid = conexao.executar(query, params)
+            return rowcount, lastrowid
+    except Error as e:
+        print(f"Erro ao executar query: {e}")
+        return None
+    finally:
+        _registrar_latencia(inicio)
+
+_passo_autoinc = None
+
+def _passo_ids(conexao):
+    """
+    Diferença entre os ids de um INSERT de várias linhas, ou None se eles não seguirem um passo fixo.
+    
+    Com innodb_autoinc_lock_mode 0 e 1 os ids de um mesmo INSERT vão de
+    auto_increment_increment em auto_increment_increment (1, salvo em
+    replicação multi-source ou clusters); no modo 2 (intercalado) podem ter lacunas.
+    """
+    global _passo_autoinc
+    if _passo_autoinc is None:
+        linhas, _, _ = conexao.executar(
+            'SELECT @@innodb_autoinc_lock_mode AS modo, @@auto_increment_increment AS incremento')
+        _passo_autoinc = int(linhas[0]['incremento']) if int(linhas[0]['modo']) <= 1 else 0
+    return _passo_autoinc or None
+
+def execute_insert_many(query, linhas, test_db=False):
+    """Insere várias linhas em uma única transação e retorna a lista de ids gerados
+
+    A query é um INSERT com um único VALUES (%s, ...). Quando o servidor garante
+    ids em passo fixo (_passo_ids), as linhas vão em um só INSERT de várias
+    linhas; caso contrário, um INSERT por linha dentro da mesma transação.
+    Levanta Error em caso de falha (após desfazer a transação).
+    """
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as conexao:
+            if conexao is None:
+                raise Error('Não foi possível conectar ao banco de dados MySQL')
+            
+            passo = _passo_ids(conexao)
+            with conexao.transacao():
+                if passo:
+                    # O texto varia com o tamanho do lote: não vai para o cache de statements
+                    prefixo, marcadores = query.rsplit('VALUES', 1)
+                    _, _, primeiro_id = conexao.executar(
+                        f"{prefixo}VALUES {', '.join([marcadores.strip()] * len(linhas))}",
+                        [valor for linha in linhas for valor in linha], preparar=False)
+                    return list(range(primeiro_id, primeiro_id + passo * len(linhas), passo))
+                return [conexao.executar(query, linha)[2] for linha in linhas]
+    finally:
+        _registrar_latencia(inicio)
+
+def execute_transaction(operacoes, test_db=False):
+    """Executa várias queries em uma única transação
+
+    Recebe uma lista de tuplas (query, params) e retorna a lista de resultados
+    no mesmo formato de execute_query. Em caso de erro, desfaz tudo e retorna None.
+    """
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as conexao:
+            if conexao is None:
+                return None
+            
+            with conexao.transacao():
+                return [_resultado(query, *conexao.executar(query, params)) for query, params in operacoes]
+    except Error as e:
+        print(f"Erro ao executar transação: {e}")
+        return None
+    finally:
+        _registrar_latencia(inicio)
+
+def stream_query(query, params=None, tamanho_lote=1000, test_db=False):
+    """Lê o resultado de uma query em lotes a partir de um snapshot consistente
+
+    Gerador que devolve listas de até tamanho_lote linhas. A leitura acontece em
+    uma transação somente leitura com snapshot consistente (MVCC do InnoDB), então
+    não bloqueia escritas na tabela durante exportações longas. Os valores são
+    devolvidos sem conversão (Decimal, date, datetime).
+    """
+    if _conexao_teste is not None:
+        # Um snapshot em outra conexão não veria o que o teste gravou
+        with _conexao(test_db) as conexao:
+            linhas, _, _ = conexao.executar(query, params, preparar=False)
+        for inicio in range(0, len(linhas), tamanho_lote):
+            yield linhas[inicio:inicio + tamanho_lote]
+        return
+    
     connection = get_db_connection(test_db)
     if connection is None:
-        return None
+        raise Error('Não foi possível conectar ao banco de dados MySQL')
     
     try:
+        connection.start_transaction(consistent_snapshot=True, readonly=True)
         cursor = connection.cursor(dictionary=True)
         cursor.execute(query, params or ())
         
-        if query.strip().upper().startswith('SELECT'):
-            result = cursor.fetchall()
-            # Converter Decimal para float para consistência com JSON
-            for row in result:
-                for key, value in row.items():
-                    if hasattr(value, '__float__'):  # Se é um tipo numérico (como Decimal)
-                        try:
-                            row[key] = float(value)
-                        except (ValueError, TypeError):
-                            pass  # Manter o valor original se não conseguir converter
-        else:
-            result = cursor.lastrowid if cursor.lastrowid else cursor.rowcount
-            
-        return result
+        while True:
+            lote = cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            yield lote
         
-    except Error as e:
-        print(f"Erro ao executar query: {e}")
-        return None
+        cursor.close()
+        connection.rollback()  # Apenas encerra a transação de leitura
     finally:
-        if connection.is_connected():
-            cursor.close()
+        try:
             connection.close()
+        except Error:
+            pass  # Resultado não lido quando a leitura é interrompida no meio
+
+def estrutura_banco(test_db=False):
+    """Tabelas do banco e colunas da tabela imoveis, como (tabelas, colunas), ou None em caso de erro"""
+    tabelas = execute_query('SHOW TABLES', test_db=test_db)
+    colunas = execute_query('DESCRIBE imoveis', test_db=test_db)
+    if tabelas is None or colunas is None:
+        return None
+    return tabelas, colunas
 
 def test_connection():
     """Testa a conexão com o banco de dados"""
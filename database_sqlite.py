@@ -0,0 +1,312 @@
+"""
+Banco SQLite em memória com a mesma interface de database_mysql
+
+Usado com DB_BACKEND=sqlite para rodar a API e os testes sem um servidor MySQL.
+Cada processo tem o seu próprio banco, então os testes podem rodar em paralelo
+(pytest -n). As queries da aplicação são escritas para o MySQL; aqui:
+
+- os marcadores %s viram ? e FOR UPDATE é removido (a conexão única já serializa as escritas)
+- LAST_INSERT_ID(expr) e UNIX_TIMESTAMP(coluna) são funções registradas na conexão
+- um trigger faz o papel de ON UPDATE CURRENT_TIMESTAMP
+- tipo e cidade usam a collation AI_CI, que compara como utf8mb4_0900_ai_ci
+- transações usam SAVEPOINT, para poderem ficar dentro da transação dos testes
+
+Todas as threads compartilham uma única conexão, protegida por um lock.
+"""
+
+import calendar
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+
+Error = sqlite3.Error
+
+NOME_BANCO = 'SQLite'
+
+# Prazo (time.monotonic) da requisição atual, definido pelo controle de admissão
+prazo_atual = ContextVar('prazo_atual', default=None)
+
+# Classe de admissão da requisição atual ('leitura', 'escrita', ...), ou None fora de requisições
+classe_atual = ContextVar('classe_atual', default=None)
+
+# Funções chamadas com a duração (em segundos) de cada acesso ao banco
+observadores_latencia = []
+
+def tempo_restante():
+    """Segundos restantes até o prazo da requisição atual, ou None se não houver prazo"""
+    prazo = prazo_atual.get()
+    if prazo is None:
+        return None
+    return prazo - time.monotonic()
+
+def _registrar_latencia(inicio):
+    """Informa aos observadores a duração de um acesso ao banco"""
+    duracao = time.monotonic() - inicio
+    for observador in observadores_latencia:
+        observador(duracao)
+
+def _converter_data(texto):
+    texto = texto.decode()
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        return texto  # O SQLite aceita datas inválidas que o MySQL recusaria
+
+def _converter_momento(texto):
+    return datetime.fromisoformat(texto.decode())
+
+# Colunas DATE e TIMESTAMP voltam como date e datetime, como no MySQL
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda momento: momento.isoformat(' '))
+sqlite3.register_converter('DATE', _converter_data)
+sqlite3.register_converter('TIMESTAMP', _converter_momento)
+
+_conexoes = {}
+_lock = threading.RLock()
+_ultimo_id = None  # Valor passado a LAST_INSERT_ID(expr) na query em execução
+
+def _last_insert_id(valor):
+    global _ultimo_id
+    _ultimo_id = valor
+    return valor
+
+def _unix_timestamp(momento):
+    if momento is None:
+        return None
+    # CURRENT_TIMESTAMP do SQLite é em UTC
+    return calendar.timegm(datetime.fromisoformat(momento).timetuple())
+
+def chave_comparacao(texto):
+    """Forma de texto com que a collation AI_CI compara valores, como a utf8mb4_0900_ai_ci do MySQL
+
+    Sem distinção de maiúsculas nem de acentos: 'São Paulo' = 'sao paulo'.
+    """
+    if texto is None:
+        return None
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+def _comparar_ai_ci(a, b):
+    a, b = chave_comparacao(a), chave_comparacao(b)
+    return (a > b) - (a < b)
+
+def get_db_connection(test_db=False):
+    """Retorna a conexão com o banco em memória, criada na primeira chamada"""
+    with _lock:
+        if test_db not in _conexoes:
+            connection = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES,
+                                         isolation_level=None, check_same_thread=False)
+            connection.create_function('LAST_INSERT_ID', 1, _last_insert_id)
+            connection.create_function('UNIX_TIMESTAMP', 1, _unix_timestamp)
+            connection.create_collation('AI_CI', _comparar_ai_ci)
+            _conexoes[test_db] = connection
+        return _conexoes[test_db]
+
+# Banco da transação de iniciar_transacao_teste, usado por todas as chamadas até desfazer_transacao_teste
+_banco_teste = None
+
+@contextmanager
+def _conexao(test_db=False):
+    """Uso exclusivo da conexão compartilhada (durante um teste, a do banco do teste)"""
+    with _lock:
+        yield get_db_connection(test_db if _banco_teste is None else _banco_teste)
+
+@contextmanager
+def _transacao(connection):
+    """Transação como savepoint: confirma sozinha ou entra na transação já aberta"""
+    connection.execute('SAVEPOINT transacao')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK TO SAVEPOINT transacao')
+        connection.execute('RELEASE SAVEPOINT transacao')
+        raise
+    else:
+        connection.execute('RELEASE SAVEPOINT transacao')
+
+def init_db(test_db=False):
+    """Inicializa o banco de dados criando a tabela de imóveis"""
+    try:
+        with _conexao(test_db) as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS imoveis (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    logradouro TEXT NOT NULL,
+                    tipo_logradouro TEXT,
+                    bairro TEXT,
+                    cidade TEXT NOT NULL COLLATE AI_CI,
+                    cep VARCHAR(10),
+                    tipo VARCHAR(50) COLLATE AI_CI,
+                    valor REAL,
+                    data_aquisicao DATE,
+                    versao INTEGER NOT NULL DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_updated_at ON imoveis (updated_at, id);
+
+                CREATE TRIGGER IF NOT EXISTS imoveis_updated_at AFTER UPDATE ON imoveis
+                FOR EACH ROW WHEN NEW.updated_at = OLD.updated_at
+                BEGIN
+                    UPDATE imoveis SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+                END;
+
+                CREATE TABLE IF NOT EXISTS imoveis_removidos (
+                    id INTEGER PRIMARY KEY,
+                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_deleted_at ON imoveis_removidos (deleted_at, id);
+            ''')
+        return True
+    except Error as e:
+        print(f"Erro ao criar tabela: {e}")
+        return False
+
+def clear_db(test_db=False):
+    """Limpa todos os dados da tabela (útil para testes)"""
+    try:
+        with _conexao(test_db) as connection:
+            connection.execute('DELETE FROM imoveis')
+            connection.execute('DELETE FROM imoveis_removidos')
+            connection.execute("DELETE FROM sqlite_sequence WHERE name = 'imoveis'")  # Reset auto increment
+        return True
+    except Error as e:
+        print(f"Erro ao limpar tabela: {e}")
+        return False
+
+def _converter_linha(row):
+    """Converte valores numéricos para float, como em database_mysql"""
+    for key, value in row.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            row[key] = float(value)
+    return row
+
+def _executar(connection, query, params=None):
+    """Executa a query e retorna (linhas ou None, linhas afetadas, último id)"""
+    global _ultimo_id
+    _ultimo_id = None
+    cursor = connection.execute(query.replace('%s', '?').replace(' FOR UPDATE', ''), tuple(params or ()))
+    try:
+        linhas = None
+        if cursor.description:
+            colunas = [coluna[0] for coluna in cursor.description]
+            linhas = [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+        # lastrowid do sqlite3 não é zerado por UPDATE/DELETE, ao contrário do MySQL
+        if query.lstrip().upper().startswith(('INSERT', 'REPLACE')):
+            ultimo_id = cursor.lastrowid
+        else:
+            ultimo_id = _ultimo_id or 0
+        return linhas, cursor.rowcount, ultimo_id
+    finally:
+        cursor.close()
+
+def _resultado(query, linhas, rowcount, lastrowid):
+    """Resultado no formato de execute_query: linhas para SELECT, senão último id ou linhas afetadas"""
+    if query.strip().upper().startswith('SELECT'):
+        return [_converter_linha(row) for row in linhas]
+    return lastrowid if lastrowid else rowcount
+
+def execute_query(query, params=None, test_db=False):
+    """Executa uma query no banco de dados"""
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as connection:
+            return _resultado(query, *_executar(connection, query, params))
+    except Error as e:
+        print(f"Erro ao executar query: {e}")
+        return None
+    finally:
+        _registrar_latencia(inicio)
+
+def execute_update(query, params=None, test_db=False):
+    """Executa um UPDATE/DELETE e retorna (linhas afetadas, LAST_INSERT_ID), ou None em caso de erro"""
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as connection:
+            _, rowcount, lastrowid = _executar(connection, query, params)
+            return rowcount, lastrowid
+    except Error as e:
+        print(f"Erro ao executar query: {e}")
+        return None
+    finally:
+        _registrar_latencia(inicio)
+
+def execute_insert_many(query, linhas, test_db=False):
+    """Insere várias linhas em uma única transação e retorna a lista de ids gerados
+
+    Levanta Error em caso de falha (após desfazer a transação).
+    """
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as connection, _transacao(connection):
+            return [_executar(connection, query, linha)[2] for linha in linhas]
+    finally:
+        _registrar_latencia(inicio)
+
+def execute_transaction(operacoes, test_db=False):
+    """Executa várias queries em uma única transação
+
+    Recebe uma lista de tuplas (query, params) e retorna a lista de resultados
+    no mesmo formato de execute_query. Em caso de erro, desfaz tudo e retorna None.
+    """
+    inicio = time.monotonic()
+    try:
+        with _conexao(test_db) as connection, _transacao(connection):
+            return [_resultado(query, *_executar(connection, query, params)) for query, params in operacoes]
+    except Error as e:
+        print(f"Erro ao executar transação: {e}")
+        return None
+    finally:
+        _registrar_latencia(inicio)
+
+def stream_query(query, params=None, tamanho_lote=1000, test_db=False):
+    """Lê o resultado de uma query em lotes
+
+    Gerador que devolve listas de até tamanho_lote linhas, sem conversão de
+    valores. O resultado é lido de uma vez, para não segurar a conexão
+    compartilhada enquanto os lotes são consumidos.
+    """
+    with _conexao(test_db) as connection:
+        linhas, _, _ = _executar(connection, query, params)
+    for inicio in range(0, len(linhas), tamanho_lote):
+        yield linhas[inicio:inicio + tamanho_lote]
+
+def estatisticas_banco():
+    """Sem pool nem cache de statements próprios no SQLite"""
+    return {'pool': None, 'statements': None}
+
+def iniciar_transacao_teste(test_db=False):
+    """
+    Abre a transação que envolve um teste; tudo o que ele gravar é desfeito em desfazer_transacao_teste.
+    
+    Até lá, todas as queries usam o banco da transação, como em database_mysql.
+    """
+    global _banco_teste
+    with _conexao(test_db) as connection:
+        connection.execute('BEGIN')
+        _banco_teste = test_db
+
+def desfazer_transacao_teste(test_db=False):
+    global _banco_teste
+    with _conexao(test_db) as connection:
+        connection.execute('ROLLBACK')
+        _banco_teste = None
+
+def estrutura_banco(test_db=False):
+    """Tabelas do banco e colunas da tabela imoveis, como (tabelas, colunas), ou None em caso de erro"""
+    tabelas = execute_query("SELECT name FROM sqlite_master WHERE type = 'table' AND name <> 'sqlite_sequence' "
+                            "ORDER BY name", test_db=test_db)
+    colunas = execute_query("SELECT * FROM pragma_table_info('imoveis')", test_db=test_db)
+    if tabelas is None or colunas is None:
+        return None
+    return tabelas, colunas
+
+def test_connection():
+    """Testa a conexão com o banco de dados"""
+    get_db_connection()
+    print(f"✅ Banco SQLite {sqlite3.sqlite_version} em memória")
+    return True
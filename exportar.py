@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Exportação em massa da tabela imoveis
+
+Gera a tabela (opcionalmente filtrada por tipo e cidade) em CSV, NDJSON ou
+Parquet, em blocos de tamanho limitado, a partir de um snapshot consistente
+do banco. Usado pelas rotas /imoveis/export da API e também pela linha de
+comando:
+
+    python exportar.py csv -o imoveis.csv --tipo apartamento
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+from banco import classe_atual, stream_query
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional, necessário apenas para Parquet
+    pa = pq = None
+
+COLUNAS = ['id', 'logradouro', 'tipo_logradouro', 'bairro', 'cidade', 'cep',
+           'tipo', 'valor', 'data_aquisicao', 'versao', 'created_at', 'updated_at']
+
+FORMATOS = {
+    'csv': {'extensao': 'csv', 'mimetype': 'text/csv'},
+    'ndjson': {'extensao': 'ndjson', 'mimetype': 'application/x-ndjson'},
+    'parquet': {'extensao': 'parquet', 'mimetype': 'application/vnd.apache.parquet'},
+}
+
+FILTROS = ['tipo', 'cidade']
+
+TAMANHO_LOTE_PADRAO = 1000
+TAMANHO_LOTE_MAXIMO = 50000
+
+DIRETORIO_EXPORTACOES = os.getenv('EXPORT_DIR', 'exports')
+
+TRABALHOS_SIMULTANEOS = int(os.getenv('EXPORT_WORKERS', 2))
+TRABALHOS_NA_FILA = int(os.getenv('EXPORT_QUEUE', 8))  # aguardando além dos que estão executando
+TTL_TRABALHOS = float(os.getenv('EXPORT_TTL', 3600))  # segundos que um trabalho concluído fica disponível
+
+
+class FormatoIndisponivel(Exception):
+    """Formato desconhecido ou sem a dependência opcional instalada"""
+
+
+class FilaCheia(Exception):
+    """Exportações em segundo plano demais aguardando ou executando"""
+
+
+def verificar_formato(formato):
+    """Valida o formato pedido, levantando FormatoIndisponivel se não puder ser gerado"""
+    if formato not in FORMATOS:
+        raise FormatoIndisponivel(f'Formato inválido: use {", ".join(FORMATOS)}')
+    if formato == 'parquet' and pq is None:
+        raise FormatoIndisponivel('Exportação Parquet requer o pacote pyarrow')
+
+
+def montar_consulta(filtros):
+    """Monta a query de exportação com os filtros informados"""
+    condicoes = []
+    params = []
+    for campo in FILTROS:
+        if filtros.get(campo):
+            condicoes.append(f'{campo} = %s')
+            params.append(filtros[campo])
+
+    query = f'SELECT {", ".join(COLUNAS)} FROM imoveis'
+    if condicoes:
+        query += f' WHERE {" AND ".join(condicoes)}'
+    return query + ' ORDER BY id', tuple(params)
+
+
+def _valor_texto(valor):
+    """Representação textual de um valor para CSV e NDJSON"""
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def _csv(lotes):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUNAS)
+    for lote in lotes:
+        for linha in lote:
+            escritor.writerow(['' if linha[c] is None else _valor_texto(linha[c]) for c in COLUNAS])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # Tabela vazia: apenas o cabeçalho
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson(lotes):
+    for lote in lotes:
+        partes = []
+        for linha in lote:
+            registro = {}
+            for c in COLUNAS:
+                valor = linha[c]
+                registro[c] = float(valor) if isinstance(valor, Decimal) else _valor_texto(valor)
+            partes.append(json.dumps(registro, ensure_ascii=False))
+        yield ('\n'.join(partes) + '\n').encode('utf-8')
+
+
+class _Coletor:
+    """Destino em memória do ParquetWriter, esvaziado a cada lote escrito"""
+
+    closed = False
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def _esquema_parquet():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('logradouro', pa.string()),
+        ('tipo_logradouro', pa.string()),
+        ('bairro', pa.string()),
+        ('cidade', pa.string()),
+        ('cep', pa.string()),
+        ('tipo', pa.string()),
+        ('valor', pa.float64()),
+        ('data_aquisicao', pa.date32()),
+        ('versao', pa.int64()),
+        ('created_at', pa.timestamp('s')),
+        ('updated_at', pa.timestamp('s')),
+    ])
+
+
+def _parquet(lotes):
+    esquema = _esquema_parquet()
+    coletor = _Coletor()
+    escritor = pq.ParquetWriter(coletor, esquema)
+    try:
+        for lote in lotes:
+            # Cada lote vira um row group, entregue assim que escrito
+            colunas = {c: [linha[c] for linha in lote] for c in COLUNAS}
+            colunas['valor'] = [None if v is None else float(v) for v in colunas['valor']]
+            escritor.write_table(pa.Table.from_pydict(colunas, schema=esquema))
+            yield coletor.esvaziar()
+    finally:
+        escritor.close()
+    yield coletor.esvaziar()
+
+
+_GERADORES = {'csv': _csv, 'ndjson': _ndjson, 'parquet': _parquet}
+
+
+def gerar_exportacao(formato, filtros=None, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """
+    Gera os bytes da exportação em blocos, um por lote de linhas.
+
+    A conexão com o banco é aberta no primeiro bloco pedido, então erros de
+    conexão aparecem já no primeiro next().
+    """
+    verificar_formato(formato)
+    query, params = montar_consulta(filtros or {})
+    lotes = stream_query(query, params, min(tamanho_lote, TAMANHO_LOTE_MAXIMO))
+    for bloco in _GERADORES[formato](lotes):
+        if bloco:
+            yield bloco
+
+
+def exportar_para_arquivo(caminho, formato, filtros=None, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """Grava a exportação em um arquivo local e retorna o número de bytes escritos"""
+    total = 0
+    with open(caminho, 'wb') as arquivo:
+        for bloco in gerar_exportacao(formato, filtros, tamanho_lote):
+            arquivo.write(bloco)
+            total += len(bloco)
+    return total
+
+
+# Exportações em segundo plano
+
+_trabalhos = {}
+_trabalhos_lock = threading.Lock()
+_expiracoes = {}  # id -> time.monotonic() a partir do qual o trabalho concluído é descartado
+_executor = ThreadPoolExecutor(TRABALHOS_SIMULTANEOS, thread_name_prefix='exportacao')
+
+
+def _executar_trabalho(trabalho, filtros, tamanho_lote):
+    classe_atual.set('lote')  # Conta no pool e na latência como as leituras caras
+    parcial = trabalho['arquivo'] + '.parcial'
+    _atualizar_trabalho(trabalho['id'], status='executando')
+    try:
+        total = exportar_para_arquivo(parcial, trabalho['formato'], filtros, tamanho_lote)
+        os.replace(parcial, trabalho['arquivo'])
+        _atualizar_trabalho(trabalho['id'], status='concluido', bytes=total,
+                            concluido_em=datetime.now().isoformat())
+    except Exception as e:
+        print(f"Erro na exportação {trabalho['id']}: {e}")
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        _atualizar_trabalho(trabalho['id'], status='erro', erro=str(e),
+                            concluido_em=datetime.now().isoformat())
+
+
+def _atualizar_trabalho(trabalho_id, **campos):
+    with _trabalhos_lock:
+        _trabalhos[trabalho_id].update(campos)
+        if campos.get('status') in ('concluido', 'erro'):
+            _expiracoes[trabalho_id] = time.monotonic() + TTL_TRABALHOS
+
+
+def _expirar_trabalhos():
+    """Descarta trabalhos concluídos há mais de TTL_TRABALHOS segundos e seus arquivos"""
+    agora = time.monotonic()
+    with _trabalhos_lock:
+        expirados = [_trabalhos.pop(trabalho_id) for trabalho_id, expira in list(_expiracoes.items())
+                     if expira <= agora]
+        for trabalho in expirados:
+            del _expiracoes[trabalho['id']]
+
+    for trabalho in expirados:
+        try:
+            os.remove(trabalho['arquivo'])
+        except FileNotFoundError:
+            pass
+
+
+def iniciar_trabalho(formato, filtros=None, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """
+    Agenda uma exportação em segundo plano e retorna o estado inicial do trabalho.
+
+    Levanta FilaCheia se já houver TRABALHOS_SIMULTANEOS + TRABALHOS_NA_FILA
+    trabalhos pendentes ou executando.
+    """
+    verificar_formato(formato)
+    _expirar_trabalhos()
+
+    trabalho_id = uuid.uuid4().hex
+    trabalho = {
+        'id': trabalho_id,
+        'formato': formato,
+        'filtros': {c: v for c, v in (filtros or {}).items() if c in FILTROS and v},
+        'status': 'pendente',
+        'bytes': None,
+        'erro': None,
+        'criado_em': datetime.now().isoformat(),
+        'concluido_em': None,
+        'arquivo': os.path.join(DIRETORIO_EXPORTACOES,
+                                f"{trabalho_id}.{FORMATOS[formato]['extensao']}"),
+    }
+    with _trabalhos_lock:
+        ativos = sum(1 for t in _trabalhos.values() if t['status'] in ('pendente', 'executando'))
+        if ativos >= TRABALHOS_SIMULTANEOS + TRABALHOS_NA_FILA:
+            raise FilaCheia(f'{ativos} exportações em andamento')
+        _trabalhos[trabalho_id] = trabalho
+
+    # Só depois da admissão: uma requisição recusada não cria nada em disco
+    os.makedirs(DIRETORIO_EXPORTACOES, exist_ok=True)
+    _executor.submit(_executar_trabalho, trabalho, trabalho['filtros'], tamanho_lote)
+    return obter_trabalho(trabalho_id)
+
+
+def obter_trabalho(trabalho_id):
+    """Retorna uma cópia do estado do trabalho, ou None se não existir (ou já tiver expirado)"""
+    _expirar_trabalhos()
+    with _trabalhos_lock:
+        trabalho = _trabalhos.get(trabalho_id)
+        return dict(trabalho) if trabalho else None
+
+
+def main():
+    """Linha de comando para exportar a tabela imoveis"""
+    parser = argparse.ArgumentParser(description='Exporta a tabela imoveis')
+    parser.add_argument('formato', choices=list(FORMATOS))
+    parser.add_argument('-o', '--saida', help='Arquivo de saída (padrão: saída padrão)')
+    parser.add_argument('--tipo', help='Filtrar por tipo')
+    parser.add_argument('--cidade', help='Filtrar por cidade')
+    parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO,
+                        help='Linhas lidas do banco por bloco')
+    args = parser.parse_args()
+
+    filtros = {'tipo': args.tipo, 'cidade': args.cidade}
+    try:
+        if args.saida:
+            total = exportar_para_arquivo(args.saida, args.formato, filtros, args.lote)
+            print(f"✅ Exportação concluída: {args.saida} ({total} bytes)", file=sys.stderr)
+        else:
+            for bloco in gerar_exportacao(args.formato, filtros, args.lote):
+                sys.stdout.buffer.write(bloco)
+    except Exception as e:
+        print(f"❌ Erro na exportação: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
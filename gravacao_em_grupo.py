@@ -0,0 +1,154 @@
+"""
+Gravação em grupo (group commit) para inserções em alta taxa
+
+Com o modo ativado (GRAVACAO_EM_GRUPO=1), POST /imoveis não abre uma conexão
+nem faz um commit por imóvel: as inserções já validadas entram em uma fila em
+memória e uma thread as grava em transações de várias linhas, a cada
+GRUPO_MAX_LINHAS linhas ou GRUPO_MAX_ESPERA_MS milissegundos, o que vier
+primeiro. Cada requisição recebe o id atribuído quando o seu lote é confirmado.
+
+- Fila cheia: a requisição grava de forma síncrona, como no modo normal
+- Falha em um lote: as linhas são regravadas uma a uma, para que uma linha
+  inválida não derrube as demais
+- Encerramento: encerrar() grava o que ainda estiver na fila
+- Desistência: quem cancelar o Future antes de o lote começar a ser gravado
+  (por exemplo, ao esgotar o prazo da requisição) não tem a linha gravada
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from banco import classe_atual, execute_insert_many
+
+
+class FilaGravacao:
+    """Fila de inserções gravadas em lotes por uma thread dedicada"""
+
+    def __init__(self, query, max_linhas=50, max_espera_ms=5, capacidade=1000):
+        self.query = query
+        self.max_linhas = max_linhas
+        self.max_espera = max_espera_ms / 1000
+        self._fila = queue.Queue(capacidade)
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='gravacao-em-grupo', daemon=True)
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.linhas = 0
+        self.maior_lote = 0
+        self.tempo_total_gravacao = 0.0
+        self.maior_tempo_gravacao = 0.0
+        self.fila_cheia = 0
+        self.canceladas = 0
+        self.erros = 0
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    def enfileirar(self, params):
+        """
+        Coloca uma linha na fila e retorna um Future com o id gerado.
+
+        Retorna None se a fila estiver cheia ou encerrada; nesse caso quem
+        chamou deve gravar de forma síncrona.
+        """
+        if self._parar.is_set():
+            return None
+        futuro = Future()
+        try:
+            self._fila.put_nowait((params, futuro))
+        except queue.Full:
+            with self._lock:
+                self.fila_cheia += 1
+            return None
+        return futuro
+
+    def _executar(self):
+        # Grava em nome das requisições de escrita (conexões reservadas do pool, latência da classe)
+        classe_atual.set('escrita')
+        # Continua até a fila esvaziar depois do pedido de parada
+        while not (self._parar.is_set() and self._fila.empty()):
+            try:
+                primeiro = self._fila.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            lote = [primeiro]
+            prazo = time.monotonic() + self.max_espera
+            while len(lote) < self.max_linhas:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+
+            self._gravar_pendentes(lote)
+
+    def _gravar_pendentes(self, lote):
+        """Grava as linhas cujo Future não foi cancelado, que a partir daqui não podem mais sê-lo"""
+        pendentes = [item for item in lote if item[1].set_running_or_notify_cancel()]
+        if len(pendentes) < len(lote):
+            with self._lock:
+                self.canceladas += len(lote) - len(pendentes)
+        if pendentes:
+            self._gravar(pendentes)
+
+    def _gravar(self, lote):
+        inicio = time.monotonic()
+        try:
+            ids = execute_insert_many(self.query, [params for params, _ in lote])
+        except Exception as e:
+            if len(lote) > 1:
+                # Regravar uma a uma para isolar a linha com problema
+                for item in lote:
+                    self._gravar([item])
+                return
+            print(f"Erro na gravação em grupo: {e}")
+            with self._lock:
+                self.erros += 1
+            lote[0][1].set_exception(e)
+            return
+
+        duracao = time.monotonic() - inicio
+        with self._lock:
+            self.lotes += 1
+            self.linhas += len(lote)
+            self.maior_lote = max(self.maior_lote, len(lote))
+            self.tempo_total_gravacao += duracao
+            self.maior_tempo_gravacao = max(self.maior_tempo_gravacao, duracao)
+
+        for (_, futuro), imovel_id in zip(lote, ids):
+            futuro.set_result(imovel_id)
+
+    def encerrar(self, timeout=30):
+        """Para de aceitar inserções e grava o que ainda estiver na fila"""
+        self._parar.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        # Inserções que entraram na fila enquanto a thread terminava
+        while True:
+            try:
+                item = self._fila.get_nowait()
+            except queue.Empty:
+                break
+            self._gravar_pendentes([item])
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'na_fila': self._fila.qsize(),
+                'lotes': self.lotes,
+                'linhas': self.linhas,
+                'tamanho_medio_lote': round(self.linhas / self.lotes, 2) if self.lotes else None,
+                'maior_lote': self.maior_lote,
+                'tempo_medio_gravacao_ms': (round(self.tempo_total_gravacao / self.lotes * 1000, 2)
+                                            if self.lotes else None),
+                'maior_tempo_gravacao_ms': round(self.maior_tempo_gravacao * 1000, 2),
+                'fila_cheia': self.fila_cheia,
+                'canceladas': self.canceladas,
+                'erros': self.erros,
+            }
@@ -2,30 +2,46 @@ import pytest
 import json
 import os
 import sys
+import threading
+import time
 from dotenv import load_dotenv
 
 # Adicionar o diretório pai ao path para importar os módulos
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app
-from database_mysql import init_db, clear_db
+from app import app, analises, contadores, QUERY_INSERIR_IMOVEL
+import admissao
+import alteracoes
+import banco
+import coalescencia
+import gravacao_em_grupo
+from banco import init_db, execute_query, iniciar_transacao_teste, desfazer_transacao_teste
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
+@pytest.fixture(scope='session', autouse=True)
+def banco_de_testes():
+    """Cria as tabelas no banco de testes uma vez por sessão (com DB_BACKEND=sqlite, em memória em cada worker)"""
+    assert init_db(test_db=True)
+    # Os testes contam com a tabela vazia: cada um desfaz o que gravou, mas nada apaga dados anteriores
+    imoveis = execute_query('SELECT COUNT(*) AS total FROM imoveis', test_db=True)
+    assert imoveis is not None and imoveis[0]['total'] == 0, 'O banco de testes (MYSQL_TEST_DATABASE) deve estar vazio'
+
 @pytest.fixture
 def client():
     """Configura o cliente de teste do Flask"""
     app.config['TESTING'] = True
     
-    # Limpar dados antes de cada teste
-    clear_db()
+    # Cada teste roda em uma transação desfeita ao final, em vez de limpar as tabelas
+    iniciar_transacao_teste(test_db=True)
+    contadores.invalidar()
+    analises.invalidar()
     
     with app.test_client() as client:
         yield client
     
-    # Limpar dados após cada teste para manter isolamento
-    clear_db()
+    desfazer_transacao_teste(test_db=True)
 
 @pytest.fixture
 def imovel_exemplo():
@@ -47,7 +63,15 @@ def test_health_check(client):
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['status'] == 'OK'
-    assert 'MySQL' in data['database']
+    assert data['database'] == f'{banco.NOME_BANCO} Connected'
+
+def test_debug_estrutura_banco(client):
+    """Testa que /debug mostra as tabelas e a estrutura da tabela imoveis"""
+    response = client.get('/debug')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['tabelas']
+    assert 'versao' in json.dumps(data['estrutura_tabela'])
 
 def test_listar_imoveis_vazio(client):
     """Testa listagem quando não há imóveis"""
@@ -215,4 +239,637 @@ def test_listar_todos_imoveis(client, imovel_exemplo):
     response = client.get('/imoveis')
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert len(data) == 3
\ No newline at end of file
+    assert len(data) == 3
+
+def test_alteracoes_criacao_e_remocao(client, imovel_exemplo):
+    """Testa o feed de alterações com criação e remoção"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    imovel_id = json.loads(response.data)['id']
+    
+    response = client.delete(f'/imoveis/{imovel_id}')
+    assert response.status_code == 200
+    
+    # Long-polling até a remoção ficar visível no feed
+    response = client.get('/imoveis/changes?wait=10')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['alteracoes'] == [
+        {'operacao': 'remocao', 'id': imovel_id, 'em': data['alteracoes'][0]['em']}
+    ]
+    
+    # Com o token retornado não há novas alterações
+    response = client.get(f"/imoveis/changes?since={data['proximo']}")
+    assert response.status_code == 200
+    data_seguinte = json.loads(response.data)
+    assert data_seguinte['alteracoes'] == []
+    assert data_seguinte['proximo'] == data['proximo']
+
+def test_alteracoes_paginacao(client, imovel_exemplo):
+    """Testa a paginação do feed de alterações com cursor"""
+    for i in range(3):
+        imovel = imovel_exemplo.copy()
+        imovel['logradouro'] = f'Rua {i}, {i*100}'
+        response = client.post('/imoveis', data=json.dumps(imovel), content_type='application/json')
+        assert response.status_code == 201
+    
+    # Aguardar as três criações ficarem visíveis no feed
+    for _ in range(5):
+        response = client.get('/imoveis/changes?wait=10')
+        assert response.status_code == 200
+        if len(json.loads(response.data)['alteracoes']) == 3:
+            break
+    
+    response = client.get('/imoveis/changes?limit=2')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data['alteracoes']) == 2
+    assert data['mais'] is True
+    
+    response = client.get(f"/imoveis/changes?limit=2&since={data['proximo']}")
+    data = json.loads(response.data)
+    assert len(data['alteracoes']) == 1
+    assert data['alteracoes'][0]['operacao'] == 'alteracao'
+    assert data['mais'] is False
+
+def test_alteracoes_token_invalido(client):
+    """Testa o feed de alterações com token inválido"""
+    response = client.get('/imoveis/changes?since=invalido!')
+    assert response.status_code == 400
+    data = json.loads(response.data)
+    assert 'erro' in data
+
+def test_alteracoes_espera_sem_consultar_o_banco(client, monkeypatch):
+    """Testa que o long-polling sem escritas não consulta o banco repetidamente"""
+    consultas = []
+    original = alteracoes.execute_query
+    monkeypatch.setattr('alteracoes.execute_query', lambda *args: consultas.append(args) or original(*args))
+    
+    response = client.get('/imoveis/changes?wait=1')
+    assert response.status_code == 200
+    assert json.loads(response.data)['alteracoes'] == []
+    assert len(consultas) <= 6  # Uma leitura no início e outra ao fim da espera
+
+def test_alteracoes_espera_invalida(client):
+    """Testa que wait não finito é rejeitado em vez de esperar indefinidamente"""
+    for espera in ['nan', 'inf', '-1']:
+        response = client.get(f'/imoveis/changes?wait={espera}')
+        assert response.status_code == 400
+
+def test_exportar_csv_filtrado(client, imovel_exemplo):
+    """Testa exportação em CSV com filtro por tipo"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    
+    imovel_casa = imovel_exemplo.copy()
+    imovel_casa['tipo'] = 'casa'
+    response = client.post('/imoveis', data=json.dumps(imovel_casa), content_type='application/json')
+    assert response.status_code == 201
+    
+    response = client.get('/imoveis/export?formato=csv&tipo=casa')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    linhas = response.data.decode('utf-8').splitlines()
+    assert linhas[0].startswith('id,logradouro')
+    assert len(linhas) == 2
+    assert ',casa,' in linhas[1]
+    response.close()
+
+def test_exportar_ndjson(client, imovel_exemplo):
+    """Testa exportação em NDJSON"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    
+    response = client.get('/imoveis/export?formato=ndjson')
+    assert response.status_code == 200
+    registros = [json.loads(linha) for linha in response.data.decode('utf-8').splitlines()]
+    assert len(registros) == 1
+    assert registros[0]['cidade'] == imovel_exemplo['cidade']
+    assert registros[0]['valor'] == imovel_exemplo['valor']
+    assert registros[0]['versao'] == 1
+    response.close()
+
+def test_exportar_formato_invalido(client):
+    """Testa exportação com formato inválido"""
+    response = client.get('/imoveis/export?formato=xml')
+    assert response.status_code == 400
+    data = json.loads(response.data)
+    assert 'erro' in data
+
+def test_exportacao_em_segundo_plano(client, imovel_exemplo, tmp_path, monkeypatch):
+    """Testa exportação em segundo plano com consulta de status e download"""
+    monkeypatch.setattr('exportar.DIRETORIO_EXPORTACOES', str(tmp_path))
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    
+    response = client.post('/imoveis/export/jobs',
+                          data=json.dumps({'formato': 'ndjson'}),
+                          content_type='application/json')
+    assert response.status_code == 202
+    trabalho_id = json.loads(response.data)['id']
+    
+    for _ in range(50):
+        response = client.get(f'/imoveis/export/jobs/{trabalho_id}')
+        assert response.status_code == 200
+        trabalho = json.loads(response.data)
+        if trabalho['status'] in ('concluido', 'erro'):
+            break
+        time.sleep(0.1)
+    assert trabalho['status'] == 'concluido'
+    
+    response = client.get(f'/imoveis/export/jobs/{trabalho_id}/download')
+    assert response.status_code == 200
+    assert len(response.data.decode('utf-8').splitlines()) == 1
+    response.close()
+
+def test_exportacao_fila_cheia(client, tmp_path, monkeypatch):
+    """Testa 503 quando não há vaga para novas exportações em segundo plano"""
+    diretorio = tmp_path / 'exports'
+    monkeypatch.setattr('exportar.DIRETORIO_EXPORTACOES', str(diretorio))
+    monkeypatch.setattr('exportar.TRABALHOS_SIMULTANEOS', 0)
+    monkeypatch.setattr('exportar.TRABALHOS_NA_FILA', 0)
+    response = client.post('/imoveis/export/jobs',
+                          data=json.dumps({'formato': 'csv'}),
+                          content_type='application/json')
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert not diretorio.exists()  # Recusada antes de criar o diretório
+
+def test_exportacao_expirada(client, tmp_path, monkeypatch):
+    """Testa que trabalhos concluídos e seus arquivos são descartados após o TTL"""
+    monkeypatch.setattr('exportar.DIRETORIO_EXPORTACOES', str(tmp_path))
+    monkeypatch.setattr('exportar.TTL_TRABALHOS', 0)
+    response = client.post('/imoveis/export/jobs',
+                          data=json.dumps({'formato': 'csv'}),
+                          content_type='application/json')
+    assert response.status_code == 202
+    trabalho_id = json.loads(response.data)['id']
+    
+    for _ in range(50):
+        response = client.get(f'/imoveis/export/jobs/{trabalho_id}')
+        if response.status_code == 404:
+            break
+        time.sleep(0.1)
+    assert response.status_code == 404
+    assert list(tmp_path.iterdir()) == []
+
+def test_exportacao_inexistente(client):
+    """Testa consulta de exportação que não existe"""
+    response = client.get('/imoveis/export/jobs/inexistente')
+    assert response.status_code == 404
+
+def test_admissao_sobrecarga(client, monkeypatch):
+    """Testa rejeição com 503 e Retry-After quando não há vagas para leitura"""
+    controle = admissao.ControleAdmissao({
+        'leitura': (1, 1, 1, 0, 0.1),
+        'lote': (1, 1, 1, 0, 0.1),
+        'escrita': (1, 1, 1, 0, 0.1),
+    })
+    monkeypatch.setattr('app.controle_admissao', controle)
+    
+    # Ocupar a única vaga de leitura
+    ticket = controle.admitir('leitura', time.monotonic() + 1)
+    assert ticket is not None
+    
+    response = client.get('/imoveis/1')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    
+    # Escritas têm sua própria classe e não são afetadas
+    response = client.delete('/imoveis/999999')
+    assert response.status_code == 404
+    
+    ticket.liberar()
+    response = client.get('/imoveis/999999')
+    assert response.status_code == 404
+
+def test_admissao_long_polling_em_classe_propria():
+    """Testa que o feed de alterações não ocupa vagas da classe lote e que o Retry-After considera a ocupação"""
+    assert admissao.classificar('GET', 'listar_alteracoes') == 'alteracoes'
+    assert admissao.classificar('GET', 'listar_imoveis') == 'lote'
+    
+    classe = admissao.ClasseAdmissao('alteracoes', 1, 1, 1, 0, 30.0)
+    assert classe.admitir(time.monotonic() + 1)
+    classe.liberar(0.25, 20.0)  # Vaga ocupada por 20 s em long-polling
+    assert classe.retry_after() == 20
+
+def test_admissao_latencia_por_classe():
+    """Testa que consultas lentas de 'lote' não reduzem o limite das leituras"""
+    controle = admissao.ControleAdmissao({
+        'leitura': (4, 1, 4, 0, 1.0),
+        'lote': (4, 1, 4, 0, 1.0),
+    }, latencia_alvo=0.25)
+    
+    token = banco.classe_atual.set('lote')
+    try:
+        controle.registrar_latencia(2.0)
+    finally:
+        banco.classe_atual.reset(token)
+    
+    for classe in ('leitura', 'lote'):
+        controle.admitir(classe, time.monotonic() + 1).liberar()
+    assert controle.classes['leitura'].limite == 4
+    assert controle.classes['lote'].limite < 4
+
+def test_pool_reserva_conexoes_por_classe(monkeypatch):
+    """Testa que escritas não ocupam a conexão reservada às leituras"""
+    database_mysql = pytest.importorskip('database_mysql')
+    monkeypatch.setattr(database_mysql, 'get_db_connection', lambda test_db=False: object())
+    pool = database_mysql._Pool(False, 3, {'leitura': 1, 'escrita': 0})
+
+    prazo = database_mysql.prazo_atual.set(time.monotonic())  # Sem espera por conexão
+    classe = database_mysql.classe_atual.set('escrita')
+    try:
+        escritas = [pool.obter(), pool.obter()]
+        assert None not in escritas
+        assert pool.obter() is None  # A última conexão é da leitura
+
+        database_mysql.classe_atual.set('leitura')
+        assert pool.obter() is not None
+
+        database_mysql.classe_atual.set('escrita')
+        pool.devolver(escritas[0])
+        assert pool.obter() is escritas[0]
+    finally:
+        database_mysql.classe_atual.reset(classe)
+        database_mysql.prazo_atual.reset(prazo)
+
+def test_passo_ids_segue_auto_increment_increment(monkeypatch):
+    """Testa que os ids de um INSERT de várias linhas seguem auto_increment_increment"""
+    database_mysql = pytest.importorskip('database_mysql')
+
+    class Conexao:
+        def __init__(self, modo, incremento):
+            self.linha = {'modo': modo, 'incremento': incremento}
+
+        def executar(self, query, params=None, preparar=True):
+            return [self.linha], 1, 0
+
+    for modo, incremento, passo in ((1, 1, 1), (1, 2, 2), (2, 1, None)):
+        monkeypatch.setattr(database_mysql, '_passo_autoinc', None)
+        assert database_mysql._passo_ids(Conexao(modo, incremento)) == passo
+
+def test_coalescencia_leituras_simultaneas():
+    """Testa que chamadas simultâneas com a mesma chave compartilham uma execução"""
+    coalescedor = coalescencia.SingleFlight()
+    liberar = threading.Event()
+    execucoes = []
+    resultados = []
+    
+    def consulta():
+        execucoes.append(1)
+        liberar.wait(5)
+        return b'[]'
+    
+    def requisicao():
+        resultados.append(coalescedor.executar(('SELECT 1', ()), consulta, 5))
+    
+    threads = [threading.Thread(target=requisicao) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while coalescedor.estatisticas()['coalescidas'] < 4:
+        time.sleep(0.01)
+    liberar.set()
+    for thread in threads:
+        thread.join()
+    
+    assert len(execucoes) == 1
+    assert [coalescida for _, coalescida in resultados].count(True) == 4
+    assert all(resultado == b'[]' for resultado, _ in resultados)
+    assert coalescedor.estatisticas()['em_andamento'] == 0
+
+def test_coalescencia_repete_apos_erro():
+    """Testa que quem aguardava uma execução que falhou executa de novo em vez de herdar o erro"""
+    coalescedor = coalescencia.SingleFlight()
+    iniciou = threading.Event()
+    liberar = threading.Event()
+    erros = []
+    
+    def consulta_com_erro():
+        iniciou.set()
+        liberar.wait(5)
+        raise RuntimeError('falha no banco')
+    
+    def requisicao(funcao):
+        try:
+            coalescedor.executar('chave', funcao, 5)
+        except RuntimeError as e:
+            erros.append(str(e))
+    
+    lider = threading.Thread(target=requisicao, args=(consulta_com_erro,))
+    lider.start()
+    iniciou.wait(5)
+    resultados = []
+    seguidor = threading.Thread(target=lambda: resultados.append(coalescedor.executar('chave', lambda: 'ok', 5)))
+    seguidor.start()
+    while coalescedor.estatisticas()['coalescidas'] < 1:
+        time.sleep(0.01)
+    liberar.set()
+    lider.join()
+    seguidor.join()
+    
+    assert erros == ['falha no banco']
+    assert resultados == [('ok', False)]
+    assert coalescedor.estatisticas()['repetidas'] == 1
+    assert coalescedor.estatisticas()['em_andamento'] == 0
+
+def test_patch_com_if_match(client, imovel_exemplo):
+    """Testa atualização parcial com pré-condição If-Match"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    imovel_id = json.loads(response.data)['id']
+    
+    response = client.get(f'/imoveis/{imovel_id}')
+    etag = response.headers['ETag']
+    
+    response = client.patch(f'/imoveis/{imovel_id}',
+                           data=json.dumps({'valor': 400000.00}),
+                           content_type='application/json',
+                           headers={'If-Match': etag, 'Prefer': 'return=representation'})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['valor'] == 400000.00
+    assert response.headers['ETag'] != etag
+    
+    # A versão antiga não vale mais
+    response = client.patch(f'/imoveis/{imovel_id}',
+                           data=json.dumps({'valor': 1.00}),
+                           content_type='application/json',
+                           headers={'If-Match': etag})
+    assert response.status_code == 412
+    
+    response = client.get(f'/imoveis/{imovel_id}')
+    data = json.loads(response.data)
+    assert data['valor'] == 400000.00
+    
+    # A representação é a mesma do GET, com os valores como ficaram gravados
+    response = client.patch(f'/imoveis/{imovel_id}',
+                           data=json.dumps({'valor': '410000.5'}),
+                           content_type='application/json',
+                           headers={'Prefer': 'return=representation'})
+    assert response.status_code == 200
+    get = client.get(f'/imoveis/{imovel_id}')
+    assert json.loads(response.data) == json.loads(get.data)
+    assert json.loads(response.data)['valor'] == 410000.50
+    assert response.headers['ETag'] == get.headers['ETag']
+
+def test_patch_imovel_inexistente(client):
+    """Testa atualização parcial de imóvel que não existe"""
+    response = client.patch('/imoveis/999999',
+                           data=json.dumps({'valor': 350000.00}),
+                           content_type='application/json',
+                           headers={'If-Match': '"1"'})
+    assert response.status_code == 404
+    data = json.loads(response.data)
+    assert data['erro'] == 'Imóvel não encontrado'
+
+def test_patch_if_match_invalido(client, imovel_exemplo):
+    """Testa atualização parcial com If-Match malformado ou que nunca coincide"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    imovel_id = json.loads(response.data)['id']
+    
+    response = client.patch(f'/imoveis/{imovel_id}',
+                           data=json.dumps({'valor': 350000.00}),
+                           content_type='application/json',
+                           headers={'If-Match': '1'})
+    assert response.status_code == 400
+    
+    # ETags fracas e versões fora do intervalo da coluna não coincidem com a versão atual
+    for etag in ['W/"1"', '"99999999999999999999999"', '"abc"']:
+        response = client.patch(f'/imoveis/{imovel_id}',
+                               data=json.dumps({'valor': 350000.00}),
+                               content_type='application/json',
+                               headers={'If-Match': etag})
+        assert response.status_code == 412
+        assert response.headers['ETag'] == '"1"'
+
+def test_patch_reaproveita_prepared_statement(client, imovel_exemplo):
+    """Testa que atualizações com campos diferentes reaproveitam o mesmo prepared statement"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    imovel_id = json.loads(response.data)['id']
+    
+    for dados in [{'valor': 1.00}, {'bairro': 'Centro'}, {'valor': 2.00, 'cep': '01000-000'}]:
+        response = client.patch(f'/imoveis/{imovel_id}', data=json.dumps(dados), content_type='application/json')
+        assert response.status_code == 200
+    statements = json.loads(client.get('/debug').data)['banco']['statements']
+    
+    response = client.patch(f'/imoveis/{imovel_id}',
+                           data=json.dumps({'tipo': 'Casa'}),
+                           content_type='application/json',
+                           headers={'If-Match': '"4", "5", "6"'})
+    assert response.status_code == 200
+    if banco.BACKEND == 'mysql':  # O SQLite não tem cache de statements próprio
+        assert json.loads(client.get('/debug').data)['banco']['statements']['acertos'] > statements['acertos']
+    
+    # Campos não enviados mantêm o valor
+    data = json.loads(client.get(f'/imoveis/{imovel_id}').data)
+    assert data['valor'] == 2.00
+    assert data['bairro'] == 'Centro'
+    assert data['cep'] == '01000-000'
+    assert data['tipo'] == 'Casa'
+    assert data['logradouro'] == imovel_exemplo['logradouro']
+
+def test_gravacao_em_grupo(client, imovel_exemplo):
+    """Testa que inserções enfileiradas são gravadas em um único lote com ids distintos"""
+    fila = gravacao_em_grupo.FilaGravacao(QUERY_INSERIR_IMOVEL, max_linhas=3, max_espera_ms=1000)
+    params = tuple(imovel_exemplo[campo] for campo in ['logradouro', 'tipo_logradouro', 'bairro', 'cidade',
+                                                        'cep', 'tipo', 'valor', 'data_aquisicao'])
+    futuros = [fila.enfileirar(params) for _ in range(3)]
+    fila.iniciar()
+    ids = [futuro.result(timeout=10) for futuro in futuros]
+    fila.encerrar()
+    
+    assert len(set(ids)) == 3
+    estatisticas = fila.estatisticas()
+    assert estatisticas['lotes'] == 1
+    assert estatisticas['maior_lote'] == 3
+    
+    for imovel_id in ids:
+        response = client.get(f'/imoveis/{imovel_id}')
+        assert response.status_code == 200
+
+def test_criar_imovel_com_gravacao_em_grupo(client, imovel_exemplo, monkeypatch):
+    """Testa POST /imoveis com a gravação em grupo ativada"""
+    fila = gravacao_em_grupo.FilaGravacao(QUERY_INSERIR_IMOVEL, max_linhas=10, max_espera_ms=5).iniciar()
+    monkeypatch.setattr('app.fila_gravacao', fila)
+    
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    fila.encerrar()
+    assert response.status_code == 201
+    imovel_id = json.loads(response.data)['id']
+    
+    response = client.get(f'/imoveis/{imovel_id}')
+    assert response.status_code == 200
+    assert fila.estatisticas()['linhas'] == 1
+
+def test_gravacao_em_grupo_prazo_esgotado(client, imovel_exemplo, monkeypatch):
+    """Testa que a inserção cujo prazo esgota na fila recebe 503 e não é gravada"""
+    fila = gravacao_em_grupo.FilaGravacao(QUERY_INSERIR_IMOVEL)  # Sem iniciar: nada é gravado
+    monkeypatch.setattr('app.fila_gravacao', fila)
+    
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json',
+                          headers={'X-Request-Timeout': '0.2'})
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    
+    fila.iniciar().encerrar()
+    assert fila.estatisticas()['canceladas'] == 1
+    response = client.get('/imoveis')
+    assert json.loads(response.data) == []
+
+def test_analise_valores_por_cidade(client, imovel_exemplo):
+    """Testa percentis de valor agrupados por cidade"""
+    for valor, cidade in [(100000.0, 'São Paulo'), (200000.0, 'São Paulo'), (300000.0, 'São Paulo'),
+                          (500000.0, 'Rio de Janeiro')]:
+        imovel = imovel_exemplo.copy()
+        imovel['valor'] = valor
+        imovel['cidade'] = cidade
+        response = client.post('/imoveis', data=json.dumps(imovel), content_type='application/json')
+        assert response.status_code == 201
+    
+    response = client.get('/imoveis/analise/valores?por=cidade')
+    assert response.status_code == 200
+    grupos = {grupo['grupo']: grupo for grupo in json.loads(response.data)['grupos']}
+    assert grupos['São Paulo']['quantidade'] == 3
+    assert grupos['São Paulo']['mediana'] == 200000.0
+    assert grupos['São Paulo']['p10'] == 120000.0
+    assert grupos['São Paulo']['p90'] == 280000.0
+    assert grupos['Rio de Janeiro']['max'] == 500000.0
+
+def test_analise_invalidada_apos_escrita(client, imovel_exemplo):
+    """Testa que o cache das análises é descartado quando um imóvel é criado"""
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    response = client.get('/imoveis/analise/histograma?por=tipo&faixas=4')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert sum(data['grupos'][0]['contagens']) == 1
+    
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+    response = client.get('/imoveis/analise/histograma?por=tipo&faixas=4')
+    data = json.loads(response.data)
+    assert len(data['limites']) == 5
+    assert sum(data['grupos'][0]['contagens']) == 2
+
+def test_analise_cache_limitado(client, imovel_exemplo, monkeypatch):
+    """Testa que o cache das análises guarda só os resultados mais recentes"""
+    monkeypatch.setattr(analises, 'tamanho_cache', 2)
+    response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+    assert response.status_code == 201
+
+    for faixas in range(2, 7):
+        response = client.get(f'/imoveis/analise/histograma?por=tipo&faixas={faixas}')
+        assert response.status_code == 200
+        assert len(json.loads(response.data)['limites']) == faixas + 1
+    assert len(analises._cache) == 2
+
+def test_analise_tendencia(client, imovel_exemplo):
+    """Testa a mediana por ano de aquisição e a variação anual"""
+    for valor, data_aquisicao in [(100000.0, '2022-03-01'), (200000.0, '2023-05-10')]:
+        imovel = imovel_exemplo.copy()
+        imovel['valor'] = valor
+        imovel['data_aquisicao'] = data_aquisicao
+        response = client.post('/imoveis', data=json.dumps(imovel), content_type='application/json')
+        assert response.status_code == 201
+    
+    response = client.get('/imoveis/analise/tendencia?tipo=apartamento')
+    assert response.status_code == 200
+    anos = json.loads(response.data)['anos']
+    assert [ano['ano'] for ano in anos] == [2022, 2023]
+    assert anos[0]['variacao_mediana'] is None
+    assert anos[1]['variacao_mediana'] == 1.0
+
+def test_analise_parametro_invalido(client):
+    """Testa análise com agrupamento inválido"""
+    response = client.get('/imoveis/analise/valores?por=bairro')
+    assert response.status_code == 400
+
+def test_listagem_paginada_com_total(client, imovel_exemplo):
+    """Testa X-Total-Count estimado e exato em listagens paginadas"""
+    for i in range(3):
+        imovel = imovel_exemplo.copy()
+        imovel['logradouro'] = f'Rua {i}, {i*100}'
+        response = client.post('/imoveis', data=json.dumps(imovel), content_type='application/json')
+        assert response.status_code == 201
+    
+    response = client.get('/imoveis?limit=2')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 2
+    assert response.headers['X-Total-Count'] == '3'
+    assert response.headers['X-Total-Count-Exact'] == 'false'
+    
+    response = client.get('/imoveis/tipo/apartamento?limit=2&offset=2&contagem=exata')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 1
+    assert response.headers['X-Total-Count'] == '3'
+    assert response.headers['X-Total-Count-Exact'] == 'true'
+
+def test_total_atualizado_apos_remocao(client, imovel_exemplo):
+    """Testa que os contadores acompanham criações e remoções"""
+    ids = []
+    for _ in range(2):
+        response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+        assert response.status_code == 201
+        ids.append(json.loads(response.data)['id'])
+    
+    response = client.get('/imoveis/cidade/São Paulo?limit=1')
+    assert response.headers['X-Total-Count'] == '2'
+    
+    response = client.delete(f'/imoveis/{ids[0]}')
+    assert response.status_code == 200
+    
+    response = client.get('/imoveis/cidade/São Paulo?limit=1')
+    assert response.headers['X-Total-Count'] == '1'
+    
+    # Sem paginação o total é o tamanho da lista
+    response = client.get('/imoveis')
+    assert response.headers['X-Total-Count'] == '1'
+    assert response.headers['X-Total-Count-Exact'] == 'true'
+
+def test_total_atualizado_apos_mudanca_de_tipo(client, imovel_exemplo):
+    """Testa que os totais por tipo acompanham atualizações do tipo"""
+    ids = []
+    for _ in range(2):
+        response = client.post('/imoveis', data=json.dumps(imovel_exemplo), content_type='application/json')
+        ids.append(json.loads(response.data)['id'])
+    
+    response = client.get('/imoveis/tipo/apartamento?limit=1')
+    assert response.headers['X-Total-Count'] == '2'
+    reconciliacoes = contadores.reconciliacoes
+    
+    response = client.patch(f'/imoveis/{ids[0]}', data=json.dumps({'tipo': 'casa'}), content_type='application/json')
+    assert response.status_code == 200
+    response = client.put(f'/imoveis/{ids[1]}', data=json.dumps({'tipo': 'casa', 'cidade': 'Campinas'}),
+                          content_type='application/json')
+    assert response.status_code == 200
+    
+    response = client.get('/imoveis/tipo/apartamento?limit=1')
+    assert response.headers['X-Total-Count'] == '0'
+    response = client.get('/imoveis/tipo/casa?limit=1')
+    assert response.headers['X-Total-Count'] == '2'
+    response = client.get('/imoveis/cidade/Campinas?limit=1')
+    assert response.headers['X-Total-Count'] == '1'
+    
+    # Os totais foram movidos com os valores anteriores, sem recontar no banco
+    assert contadores.reconciliacoes == reconciliacoes
+
+def test_total_ignora_maiusculas_e_acentos(client, imovel_exemplo):
+    """Testa que o total segue a collation do banco, como o filtro da listagem"""
+    for cidade in ('São Paulo', 'SAO PAULO'):
+        response = client.post('/imoveis', data=json.dumps({**imovel_exemplo, 'cidade': cidade}),
+                               content_type='application/json')
+        assert response.status_code == 201
+
+    response = client.get('/imoveis/cidade/sao paulo?limit=1')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 1
+    assert response.headers['X-Total-Count'] == '2'
+
+    response = client.get('/imoveis/cidade/sao paulo?limit=1&contagem=exata')
+    assert response.headers['X-Total-Count'] == '2'
+
+def test_listagem_paginacao_invalida(client):
+    """Testa listagem com parâmetros de paginação inválidos"""
+    response = client.get('/imoveis?limit=0')
+    assert response.status_code == 400